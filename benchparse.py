@@ -0,0 +1,38 @@
+#!/usr/bin/python
+# Micro-benchmark for xlog line parsing: compares the old replace/split
+# parser with xlog.parser.parse_xlog over the lines in sample-log.txt.
+#     python benchparse.py [logfile] [passes]
+
+import sys
+import time
+import xlog.parser
+
+def parse_logline_split(logline):
+  """The previous implementation of scload.parse_logline."""
+  logline = logline.replace("::", "\n")
+  return dict([(item[:item.index('=')],
+                item[item.index('=') + 1:].replace("\n", ":"))
+               for item in logline.split(':')])
+
+def bench(name, fn, lines, passes):
+  start = time.time()
+  for i in range(passes):
+    for l in lines:
+      fn(l)
+  elapsed = time.time() - start
+  rate = len(lines) * passes / elapsed
+  print "%-12s %8d lines in %.3fs: %d lines/s" % (name, len(lines) * passes,
+                                                  elapsed, rate)
+  return rate
+
+if __name__ == '__main__':
+  filename = len(sys.argv) > 1 and sys.argv[1] or 'sample-log.txt'
+  passes = len(sys.argv) > 2 and int(sys.argv[2]) or 20
+  lines = [l.strip() for l in open(filename) if l.strip()]
+  for l in lines:
+    if parse_logline_split(l) != xlog.parser.parse_xlog(l):
+      print "Parsers disagree on: " + l
+      sys.exit(1)
+  before = bench('split', parse_logline_split, lines, passes)
+  after = bench('parse_xlog', xlog.parser.parse_xlog, lines, passes)
+  print "Speedup: %.2fx" % (after / before)
@@ -0,0 +1,103 @@
+#!/usr/bin/python
+# Micro-benchmark for html.table_text: renders a synthetic all-players table
+# with the old string-concatenating implementation and the current one, and
+# checks that they agree.
+#     python benchtable.py [rows] [passes]
+
+import sys
+import time
+import random
+import html
+from html import wrap_tuple, column_class, fixup_column, is_player_header
+from crawl_utils import linked_text, player_link
+
+def table_text_concat(headers, data, cls='bordered', count=True, fixup=False):
+  """The previous implementation of html.table_text (without the options
+  that the all-players table doesn't use)."""
+  html.force_locale()
+  if cls:
+    cls = ''' class="%s"''' % cls
+  out = '''<table%s%s>\n<tr>''' % (cls or '', '')
+
+  headers = [ wrap_tuple(x) for x in headers ]
+
+  if count:
+    out += "<th>&nbsp;</th>"
+  for head in headers:
+    out += "<th>%s</th>" % head[0]
+  out += "</tr>\n"
+  odd = True
+
+  nrow = 0
+
+  ncols = len(headers) + (count and 1 or 0)
+  if not data:
+    out += '''<tr><td colspan='%s'>%s</td></tr>''' % (ncols, 'No data')
+
+  nplace = 0
+  for row in data:
+    nrow += 1
+    rowcls = odd and "odd" or "even"
+    out += '''<tr class="%s">''' % rowcls
+    odd = not odd
+
+    nplace += 1
+    if count:
+      out += '''<td class="numeric">%s</td>''' % nplace
+
+    for c in range(len(headers)):
+      val = row[c]
+      header = headers[c]
+      tcls = column_class(header[0], val)
+      if fixup:
+        val = fixup_column(header[0], val, {})
+      out += '''<td class="%s">''' % tcls
+      val = str(val)
+      if is_player_header(header[0]):
+        val = linked_text(val, player_link)
+      out += val
+      out += '</td>'
+    out += "</tr>\n"
+  out += '</table>\n'
+  return out
+
+HEADERS = [ 'Total Score', 'Player', 'Games Played', 'Games Won', 'Win %',
+            'Best XL', 'Best Score', 'Average Score', 'First Game',
+            'Most Recent Game' ]
+
+def player_rows(n):
+  """Rows shaped like query.all_player_stats."""
+  random.seed(1)
+  rows = [ ]
+  for i in range(n):
+    games = random.randint(1, 5000)
+    wins = random.randint(0, games / 10)
+    total = random.randint(0, 50000000)
+    rows.append([total, 'player%d' % i, games, wins,
+                 "%.2f%%" % (wins * 100.0 / games), random.randint(1, 27),
+                 '<a href="morgue">%s</a>' % random.randint(0, 5000000),
+                 total / games,
+                 '<a href="morgue">2015-01-01 00:00:00</a>',
+                 '<a href="morgue">2020-01-01 00:00:00</a>'])
+  rows.sort(reverse=True)
+  return rows
+
+def bench(name, fn, rows, passes):
+  start = time.time()
+  for i in range(passes):
+    fn(HEADERS, rows, fixup=True)
+  elapsed = (time.time() - start) / passes
+  print "%-12s %8d rows in %.3fs" % (name, len(rows), elapsed)
+  return elapsed
+
+if __name__ == '__main__':
+  nrows = len(sys.argv) > 1 and int(sys.argv[1]) or 50000
+  passes = len(sys.argv) > 2 and int(sys.argv[2]) or 3
+  rows = player_rows(nrows)
+  if table_text_concat(HEADERS, rows, fixup=True) != \
+        html.table_text(HEADERS, rows, fixup=True):
+    print "Table renderers disagree!"
+    sys.exit(1)
+  before = bench('concat', table_text_concat, rows, passes)
+  after = bench('table_text', html.table_text, rows, passes)
+  print "Speedup: %.2fx" % (before / after)
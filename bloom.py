@@ -0,0 +1,85 @@
+import hashlib
+import struct
+import math
+import json
+
+class BloomFilter(object):
+  """A Bloom filter of strings: `key in f` is always True for a key that has
+  been added, and False for all but roughly `error_rate` of the keys that
+  haven't, as long as no more than `capacity` keys are added.
+
+  >>> f = BloomFilter(1000, 0.01)
+  >>> f.add('a'); f.add('b')
+  >>> 'a' in f, 'b' in f, 'c' in f
+  (True, True, False)
+  >>> import tempfile
+  >>> path = tempfile.mktemp()
+  >>> f.save(path, extra={'x': 1})
+  >>> g, extra = BloomFilter.load(path)
+  >>> 'a' in g, 'c' in g, g.count, extra
+  (True, False, 2, {u'x': 1})
+  """
+  def __init__(self, capacity, error_rate=0.001):
+    self.capacity = capacity
+    self.error_rate = error_rate
+    self.nbits = int(math.ceil(-capacity * math.log(error_rate)
+                               / (math.log(2) ** 2)))
+    self.nhashes = max(1, int(round(self.nbits * math.log(2) / capacity)))
+    self.bits = bytearray((self.nbits + 7) / 8)
+    self.count = 0
+
+  def positions(self, key):
+    # double hashing: the i'th position is h1 + i * h2.
+    h1, h2 = struct.unpack('<QQ', hashlib.md5(key).digest())
+    n = self.nbits
+    return [(h1 + i * h2) % n for i in range(self.nhashes)]
+
+  def add(self, key):
+    bits = self.bits
+    for p in self.positions(key):
+      bits[p >> 3] |= 1 << (p & 7)
+    self.count += 1
+
+  def __contains__(self, key):
+    bits = self.bits
+    for p in self.positions(key):
+      if not bits[p >> 3] & (1 << (p & 7)):
+        return False
+    return True
+
+  def full(self):
+    return self.count > self.capacity
+
+  def save(self, path, extra=None):
+    """Write the filter to path: a line of JSON (including `extra`) followed by
+    the bits."""
+    f = open(path, 'wb')
+    try:
+      f.write(json.dumps({ 'capacity': self.capacity,
+                           'error_rate': self.error_rate,
+                           'count': self.count,
+                           'extra': extra }) + '\n')
+      f.write(self.bits)
+    finally:
+      f.close()
+
+  @classmethod
+  def load(cls, path):
+    """Read a filter written by `save`; returns (filter, extra)."""
+    f = open(path, 'rb')
+    try:
+      header = json.loads(f.readline())
+      bf = cls(header['capacity'], header['error_rate'])
+      bits = bytearray(f.read())
+    finally:
+      f.close()
+    if len(bits) != len(bf.bits):
+      raise ValueError("%s: expected %d bytes of filter, found %d"
+                       % (path, len(bf.bits), len(bits)))
+    bf.bits = bits
+    bf.count = header['count']
+    return bf, header['extra']
+
+if __name__ == "__main__":
+  import doctest
+  doctest.testmod()
@@ -0,0 +1,154 @@
+# Support for loading game rows into an empty db with LOAD DATA LOCAL INFILE
+# instead of INSERT, for --bulk-load. While a bulk load is running, the
+# secondary indexes that are only used for reading (page generation) are
+# dropped, and they are recreated from indexes.sql at the end. A bulk load
+# leaves UNFINISHED_FILE behind until its indexes are back, and if it dies
+# part way through, `restore_indexes` recreates anything missing on the next
+# run. Otherwise missing indexes are only reported: an admin may have dropped
+# them on purpose, and the DDL would commit implicitly in the middle of a load.
+
+import os
+import re
+import tempfile
+
+import logging
+from logging import debug, info, warn, error
+
+import config
+
+INDEX_FILE = 'indexes.sql'
+UNFINISHED_FILE = os.path.join(config.LOCALBASE,
+                               '%s.bulk-load' % config.SCORING_KEY)
+
+# Indexes from INDEX_FILE that nothing on the write path relies on. Anything
+# used by the loader's own DELETE/SELECT queries, and any unique index, needs
+# to stay.
+READ_INDEXES = [ 'wins_name', 'wins_dur', 'wins_turn', 'wins_sc',
+                 'all_recent_games_end', 'player_recent_games_name_end',
+                 'player_total_scores', 'players_total_score',
+                 'players_win_stats',
+                 'top_killers_kills', 'ghost_victims_ghost',
+                 'ghost_victims_victim', 'date_players_month' ]
+
+R_CREATE_INDEX = re.compile(r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+(\w+)\s+ON\s+(\w+)',
+                            re.I)
+
+ACTIVE = False
+_indexes_checked = False
+
+def active():
+  return ACTIVE
+
+def index_definitions():
+  """Returns a dict of index name -> (table, CREATE statement) for the
+  indexes in READ_INDEXES."""
+  f = open(INDEX_FILE)
+  try:
+    statements = f.read().split(';')
+  finally:
+    f.close()
+  defs = { }
+  for s in statements:
+    m = R_CREATE_INDEX.search(s)
+    if m and m.group(1) in READ_INDEXES:
+      defs[m.group(1)] = (m.group(2), s.strip())
+  return defs
+
+def unfinished():
+  return os.path.exists(UNFINISHED_FILE)
+
+def existing_indexes(c, tables):
+  c.execute('''SELECT DISTINCT table_name, index_name
+                 FROM information_schema.statistics
+                WHERE table_schema = DATABASE()''')
+  return set([(t.lower(), i) for t, i in c.fetchall()
+              if t.lower() in tables])
+
+def begin(c):
+  """Start a bulk load: drop the read-only indexes."""
+  global ACTIVE
+  defs = index_definitions()
+  have = existing_indexes(c, set([t for t, s in defs.values()]))
+  open(UNFINISHED_FILE, 'w').close()
+  info("Bulk loading into an empty db: dropping %d read-only indexes."
+       % len(defs))
+  for name, (table, create) in defs.items():
+    if (table, name) in have:
+      c.execute("DROP INDEX %s ON %s" % (name, table))
+  ACTIVE = True
+
+def end(c):
+  """Finish a bulk load, if one is running: recreate the dropped indexes."""
+  global ACTIVE
+  if not ACTIVE:
+    return
+  ACTIVE = False
+  info("Bulk load done, rebuilding indexes.")
+  restore_indexes(c)
+
+def missing_indexes(c):
+  """Returns a list of (name, table, CREATE statement) for the read-only
+  indexes that don't exist."""
+  defs = index_definitions()
+  have = existing_indexes(c, set([t for t, s in defs.values()]))
+  return [(name, table, create)
+          for name, (table, create) in sorted(defs.items())
+          if (table, name) not in have]
+
+def restore_indexes(c):
+  """Recreate any read-only indexes that are missing, e.g. after a bulk load
+  that didn't finish."""
+  for name, table, create in missing_indexes(c):
+    info("Creating index %s on %s" % (name, table))
+    c.execute(create)
+  if unfinished():
+    os.unlink(UNFINISHED_FILE)
+
+def check_indexes(c, restore=False):
+  """The first time this is called in a process: if `restore` is set (for
+  --bulk-load) or a bulk load didn't finish, call `restore_indexes`;
+  otherwise just warn about missing indexes."""
+  global _indexes_checked
+  if _indexes_checked:
+    return
+  _indexes_checked = True
+  if restore or unfinished():
+    restore_indexes(c)
+    return
+  missing = missing_indexes(c)
+  if missing:
+    warn("Missing read-only indexes (not recreated without --bulk-load): %s"
+         % ", ".join(["%s on %s" % (name, table)
+                      for name, table, create in missing]))
+
+def tsv_value(v):
+  if v is None:
+    return '\\N'
+  if isinstance(v, unicode):
+    v = v.encode('utf-8')
+  elif not isinstance(v, str):
+    return str(v)
+  return (v.replace('\\', '\\\\').replace('\t', '\\t')
+           .replace('\n', '\\n').replace('\r', '\\r'))
+
+def load_rows(c, table, colnames, rows):
+  """Load rows (sequences of values for the comma-separated `colnames`) into
+  table, by writing them to a temporary file and using LOAD DATA LOCAL
+  INFILE. As with INSERT IGNORE, rows with duplicate keys are skipped."""
+  if not rows:
+    return
+  fd, path = tempfile.mkstemp(prefix='scload-%s-' % table, suffix='.tsv')
+  try:
+    f = os.fdopen(fd, 'w')
+    try:
+      for r in rows:
+        f.write('\t'.join([tsv_value(v) for v in r]))
+        f.write('\n')
+    finally:
+      f.close()
+    c.execute("LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE " + table +
+              " CHARACTER SET " + c.db.character_set_name() +
+              " (" + colnames + ")",
+              (path,))
+  finally:
+    os.unlink(path)
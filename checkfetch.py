@@ -0,0 +1,119 @@
+#!/usr/bin/python
+# Checks xlog.fetch against local http servers: Range resume, a server that
+# ignores Range, 416 for a file with nothing new, and backoff after a timeout.
+#     python checkfetch.py
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import BaseHTTPServer
+import SocketServer
+
+import xlog.fetch
+from xlog.xlog_def import XlogDef
+
+FILES = { '/logfile': 'v=1:name=a\n', '/slow': 'v=1:name=b\n' }
+REQUESTS = [ ]
+SLOW_SECONDS = 2
+
+class Handler (BaseHTTPServer.BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def log_message(self, *args):
+    pass
+
+  def do_GET(self):
+    REQUESTS.append((self.server.name, self.path, self.headers.get('range')))
+    if self.path == '/slow':
+      time.sleep(SLOW_SECONDS)
+    body = FILES[self.path]
+    m = re.match(r'bytes=(\d+)-$', self.headers.get('range') or '')
+    if m and self.server.ranges:
+      start = int(m.group(1))
+      if start >= len(body):
+        self.send_response(416)
+        self.send_header('Content-Range', 'bytes */%d' % len(body))
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+        return
+      self.send_response(206)
+      self.send_header('Content-Range', 'bytes %d-%d/%d'
+                       % (start, len(body) - 1, len(body)))
+      body = body[start:]
+    else:
+      self.send_response(200)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+class Server (SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+  daemon_threads = True
+
+def serve(name, ranges):
+  server = Server(('127.0.0.1', 0), Handler)
+  server.name = name
+  server.ranges = ranges
+  t = threading.Thread(target=server.serve_forever)
+  t.daemon = True
+  t.start()
+  return 'http://127.0.0.1:%d' % server.server_address[1]
+
+def check(what, ok):
+  print "%-50s %s" % (what, ok and 'ok' or 'FAILED')
+  return ok
+
+def run():
+  ranged = XlogDef('logfile', 'ranged', serve('ranged', True), None, None,
+                   'logfile')
+  plain = XlogDef('logfile', 'plain', serve('plain', False), None, None,
+                  'logfile')
+  slow = XlogDef('slow', 'slow', serve('slow', True), None, None, 'logfile',
+                 fetch_timeout=SLOW_SECONDS / 2.0)
+  xlogs = [ ranged, plain, slow ]
+  fetcher = xlog.fetch.Fetcher(workers=3)
+  ok = True
+
+  fetched = fetcher.fetch(xlogs)
+  ok &= check("first fetch gets the whole files",
+              fetched == { 'ranged': 11, 'plain': 11 }
+              and open(ranged.local_path).read() == FILES['/logfile'])
+  ok &= check("a timeout backs off the source",
+              fetcher.sources['slow'].backing_off(time.time()))
+
+  FILES['/logfile'] += 'v=1:name=c\n'
+  del REQUESTS[:]
+  start = time.time()
+  fetched = fetcher.fetch(xlogs)
+  ok &= check("resume fetches only the new bytes with Range",
+              fetched.get('ranged') == 11
+              and ('ranged', '/logfile', 'bytes=11-') in REQUESTS
+              and open(ranged.local_path).read() == FILES['/logfile'])
+  ok &= check("a 200 reply to a Range request skips the old bytes",
+              fetched.get('plain') == 11
+              and open(plain.local_path).read() == FILES['/logfile'])
+  ok &= check("a source that is backing off is not fetched",
+              not [r for r in REQUESTS if r[0] == 'slow']
+              and time.time() - start < SLOW_SECONDS)
+
+  del REQUESTS[:]
+  fetched = fetcher.fetch([ ranged ])
+  ok &= check("416 for a file with nothing new fetches nothing",
+              fetched == { 'ranged': 0 }
+              and open(ranged.local_path).read() == FILES['/logfile']
+              and not fetcher.sources['ranged'].failures)
+  return ok
+
+if __name__ == '__main__':
+  cwd = os.getcwd()
+  tmp = tempfile.mkdtemp()
+  os.chdir(tmp)
+  try:
+    ok = run()
+  finally:
+    os.chdir(cwd)
+    shutil.rmtree(tmp)
+  sys.exit(not ok and 1 or 0)
@@ -44,6 +44,14 @@ OVERVIEW_URL = ('''<a href="%s">Overview</a>''' %
 
 RAWDATA_PATH = CONFIG.get('rawdata-base')
 
+# compiled templates are kept here between runs; null compiles them afresh in
+# every process.
+TEMPLATE_CACHE_DIR = CONFIG.get('template-cache',
+                                os.path.join(LOCALBASE, 'template-cache'))
+
+# memoized function name -> number of results to keep (see memoizer.py)
+MEMOIZER_SIZES = CONFIG.get('memoizer-sizes') or { }
+
 MKDIRS = [ SCORE_FILE_DIR, PLAYER_FILE_DIR ]
 
 # TODO: should this be here?
@@ -232,6 +232,7 @@ CREATE TABLE players (
   current_combo CHAR(4)
   );
 CREATE INDEX player_total_scores ON players (name, total_score);
+CREATE INDEX players_total_score ON players (total_score);
 CREATE INDEX players_win_stats ON players (games_won DESC, games_played);
 
 -- Statistics on the games the player has played.
@@ -126,18 +126,35 @@ def pretty_server(game):
     return '<a href="%s">%s</a>' % (url, name)
   return name
 
-def fixup_column(col, data, game):
+def fixup_place(data, game):
+  if game.get('ktyp') == 'winning':
+    return ''
+  return data
+
+def fixup_number(data, game):
+  if isinstance(data, (int,long)):
+    return human_number(data)
+  return data
+
+def column_fixup(col):
+  """Returns the function (data, game) -> display value for column col, or
+  None if the column is displayed as is."""
   if col.find('time') != -1:
-    return pretty_date(data)
+    return lambda data, game: pretty_date(data)
   elif col.find('dur') != -1:
-    return pretty_dur(data)
-  elif col == 'place' and game.get('ktyp') == 'winning':
-    return ''
+    return lambda data, game: pretty_dur(data)
+  elif col == 'place':
+    return fixup_place
   elif col == 'server':
-    return pretty_server(game)
-  elif (isinstance(data, (int,long)) and
-        (col == 'sc' or col == 'turn' or col.lower().find('score') != -1)):
-    return human_number(data)
+    return lambda data, game: pretty_server(game)
+  elif col == 'sc' or col == 'turn' or col.lower().find('score') != -1:
+    return fixup_number
+  return None
+
+def fixup_column(col, data, game):
+  fn = column_fixup(col)
+  if fn:
+    return fn(data, game)
   return data
 
 def pretty_dur(dur):
@@ -205,6 +222,12 @@ def column_class(cname, data):
   else:
     return isinstance(data, str) and "celltext" or "numeric"
 
+def cell_class(numeric, data):
+  """column_class, for a column already checked with is_numeric_column."""
+  if numeric or not isinstance(data, str):
+    return "numeric"
+  return "celltext"
+
 def streak_legend(found_active):
   return ""
 
@@ -251,32 +274,34 @@ def table_text(headers, data, cls='bordered',
     cls = ''' class="%s"''' % cls
   if width:
     width = ' width="%s%%"' % width
-  out = '''<table%s%s>\n<tr>''' % (cls or '', width or '')
+  out = [ '''<table%s%s>\n<tr>''' % (cls or '', width or '') ]
 
   headers = [ wrap_tuple(x) for x in headers ]
 
   if count:
-    out += "<th>&nbsp;</th>"
+    out.append("<th>&nbsp;</th>")
   for head in headers:
-    out += "<th>%s</th>" % head[0]
-  out += "</tr>\n"
-  odd = True
-
-  nrow = 0
+    out.append("<th>%s</th>" % head[0])
+  out.append("</tr>\n")
 
   ncols = len(headers) + (count and 1 or 0)
   if not data:
-    out += '''<tr><td colspan='%s'>%s</td></tr>''' % (ncols, stub_text)
+    out.append('''<tr><td colspan='%s'>%s</td></tr>''' % (ncols, stub_text))
+
+  # work out what each column needs once, rather than for every cell.
+  columns = [ (is_numeric_column(h[0]), fixup and column_fixup(h[0]),
+               is_player_header(h[0]))
+              for h in headers ]
 
+  odd = True
   nplace = 0
   last_value = None
 
   for row in data:
-    nrow += 1
     rowcls = odd and "odd" or "even"
     if rowclsfn:
       rowcls += " " + rowclsfn(row)
-    out += '''<tr class="%s">''' % rowcls
+    out.append('''<tr class="%s">''' % rowcls)
     odd = not odd
 
     if place_column == -1 or last_value != row[place_column]:
@@ -285,25 +310,23 @@ def table_text(headers, data, cls='bordered',
       last_value = row[place_column]
 
     if count:
-      out += '''<td class="numeric">%s</td>''' % nplace
+      out.append('''<td class="numeric">%s</td>''' % nplace)
 
     rdat = rowdatafn and rowdatafn(row) or row
 
-    for c in range(len(headers)):
-      val = rdat[c]
-      header = headers[c]
-      tcls = column_class(header[0], val)
-      if fixup:
-        val = fixup_column(header[0], val, {})
-      out += '''<td class="%s">''' % tcls
+    for val, (numeric, fixupfn, player) in zip(rdat, columns):
+      tcls = cell_class(numeric, val)
+      if fixupfn:
+        val = fixupfn(val, {})
       val = str(val)
-      if is_player_header(header[0]):
+      if player:
         val = linked_text(val, player_link)
-      out += val
-      out += '</td>'
-    out += "</tr>\n"
-  out += '</table>\n'
-  return out
+      out.append('''<td class="%s">''' % tcls)
+      out.append(val)
+      out.append('</td>')
+    out.append("</tr>\n")
+  out.append('</table>\n')
+  return ''.join(out)
 
 def games_table(games, first=None, excluding=None, columns=None,
                 including=None, cls='bordered', count=True, win=False):
@@ -329,19 +352,24 @@ def games_table(games, first=None, excluding=None, columns=None,
 
   if cls:
     cls = ''' class="%s"''' % cls
-  out = '''<table%s>\n<tr>''' % (cls or '')
+  out = [ '''<table%s>\n<tr>''' % (cls or '') ]
   if count:
-    out += "<th></th>"
+    out.append("<th></th>")
   for col in columns:
-    out += "<th>%s</th>" % col[1]
-  out += "</tr>\n"
-  odd = True
-  ngame = 0
+    out.append("<th>%s</th>" % col[1])
+  out.append("</tr>\n")
 
   ncols = len(columns) + (count and 1 or 0)
   if not games:
-    out += '''<tr><td colspan='%s'>No games</td></tr>''' % ncols
+    out.append('''<tr><td colspan='%s'>No games</td></tr>''' % ncols)
+
+  # (field, fixup, numeric, morgue link, player link) for each column.
+  cols = [ (c[0], column_fixup(c[0]), is_numeric_column(c[0]),
+            len(c) >= 3 and c[2], is_player_header(c[1]))
+           for c in columns ]
 
+  odd = True
+  ngame = 0
   for game in games:
     ngame += 1
 
@@ -349,28 +377,28 @@ def games_table(games, first=None, excluding=None, columns=None,
     if game.get('ktyp') == 'winning':
       ocls += " win"
 
-    out += '''<tr class="%s">''' % ocls
+    out.append('''<tr class="%s">''' % ocls)
     odd = not odd
 
     if count:
-      out += '''<td class="numeric">%s</td>''' % ngame
+      out.append('''<td class="numeric">%s</td>''' % ngame)
 
-    for c in columns:
-      val = fixup_column(c[0], game.get(c[0]) or '', game)
-      tcls = column_class(c[0], val)
-      out += '''<td class="%s">''' % tcls
+    for field, fixupfn, numeric, need_link, player in cols:
+      val = game.get(field) or ''
+      if fixupfn:
+        val = fixupfn(val, game)
+      out.append('''<td class="%s">''' % cell_class(numeric, val))
 
-      need_link = len(c) >= 3 and c[2]
       if need_link:
-        out += linked_text(game, morgue_link, str(val))
-      elif is_player_header(c[1]):
-        out += linked_text(val, player_link)
+        out.append(linked_text(game, morgue_link, str(val)))
+      elif player:
+        out.append(linked_text(val, player_link))
       else:
-        out += str(val)
-      out += '</td>'
-    out += "</tr>\n"
-  out += "</table>\n"
-  return out
+        out.append(str(val))
+      out.append('</td>')
+    out.append("</tr>\n")
+  out.append("</table>\n")
+  return ''.join(out)
 
 def full_games_table(games, **pars):
   if not pars.get('columns'):
@@ -388,8 +416,9 @@ def ext_games_table(games, win=False, **pars):
     pars['count'] = False
   return games_table(games, columns=cols, **pars)
 
-def combo_highscorers(c, limit=10):
-  hs = query.top_combo_scorers(c)
+def combo_highscorers(c, limit=10, hs=None):
+  if hs is None:
+    hs = query.top_combo_scorers(c)
   return table_text( [ 'Highscores', 'Player', 'Characters' ],
                      hs[:limit], count = True, place_column = 0 )
 
@@ -708,8 +737,8 @@ def player_stats_matrix(stats, thing):
     res += '<tr>' + "".join([player_stats_cell(x, thing) for x in row]) + '</tr>'
   return res + '</table>'
 
-def overall_player_stats(c, player):
-  ostats = [ query.overall_player_stats(c, player) ]
+def overall_player_stats(c, player, ostats=None):
+  ostats = [ ostats or query.overall_player_stats(c, player) ]
   def pstat_row(r):
     return [ r['total_score'], r['games_played'], r['games_won'],
              r['win_perc'], r['best_xl'], r['best_score'], r['avg_score'],
@@ -29,6 +29,7 @@ CREATE INDEX streaks_order ON streaks (ngames DESC, id);
 CREATE INDEX streaks_player ON streaks (player);
 CREATE INDEX streaks_player_active ON streaks (player, active);
 CREATE INDEX player_total_scores ON players (name, total_score);
+CREATE INDEX players_total_score ON players (total_score);
 CREATE INDEX players_win_stats ON players (games_won DESC, games_played);
 CREATE UNIQUE INDEX player_cstats_name_char
                  ON player_char_stats (name, charabbr);
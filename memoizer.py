@@ -1,41 +1,103 @@
+import config
+
+MISSING = object()
+
+# A size for memoizers keyed by player name, which see tens of thousands of
+# players in a full load.
+PLAYER_CACHE_SIZE = 50000
+
 class Memoizer (object):
-  FLUSH_THRESHOLD = 1000
   """Given a function, caches the results of the function for sets of arguments
-  and returns the cached result where possible. Do not use if you have
-  very large possible combinations of args, or we'll run out of RAM."""
-  def __init__(self, fn, extractor=None):
+  and returns the cached result where possible. At most `size` results are
+  kept (the memoizer-sizes config key overrides this for a function, by name).
+  The cache is split into a recent and an older generation; when the recent
+  one fills up the older one is dropped, and a hit in the older one moves the
+  result back to the recent one. That evicts roughly the least recently used
+  results using only plain dict operations, which are atomic across the
+  loader's threads."""
+  DEFAULT_SIZE = 1000
+  instances = [ ]
+
+  def __init__(self, fn, extractor=None, size=None):
     self.fn = fn
-    self.cache = { }
+    self.name = fn.__name__
+    self.size = (config.MEMOIZER_SIZES.get(self.name)
+                 or size or Memoizer.DEFAULT_SIZE)
+    self.generation_size = max(self.size / 2, 1)
+    self.recent = { }
+    self.older = { }
     self.extractor = extractor or (lambda baz: baz)
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+    Memoizer.instances.append(self)
+
+  @classmethod
+  def sized(cls, size):
+    """Decorator for a function whose memoizer keeps `size` results."""
+    return lambda fn: cls(fn, size=size)
 
   def __call__(self, *args):
-    if len(self.cache) > Memoizer.FLUSH_THRESHOLD:
-      self.flush()
     key = self.extractor(args)
-    if not self.cache.has_key(key):
-      value = self.fn(*args)
-      self.cache[key] = value
+    value = self.recent.get(key, MISSING)
+    if value is not MISSING:
+      self.hits += 1
       return value
-    return self.cache[key]
+    value = self.older.pop(key, MISSING)
+    if value is MISSING:
+      self.misses += 1
+      value = self.fn(*args)
+    else:
+      self.hits += 1
+    self.store(key, value)
+    return value
+
+  def store(self, key, value):
+    if key not in self.recent and len(self.recent) >= self.generation_size:
+      self.evictions += len(self.older)
+      self.older = self.recent
+      self.recent = { }
+    self.recent[key] = value
+
+  def __len__(self):
+    return len(self.recent) + len(self.older)
 
   def flush(self):
-    self.cache.clear()
+    self.recent = { }
+    self.older = { }
 
   def flush_key(self, *args):
-    try:
-      del self.cache[args]
-    except KeyError:
-      pass
+    self.recent.pop(args, None)
+    self.older.pop(args, None)
 
   def has_key(self, *args):
-    return self.cache.has_key(args)
+    return args in self.recent or args in self.older
 
   def set_key(self, value, *args):
-    self.cache[args] = value
+    self.older.pop(args, None)
+    self.store(args, value)
 
   def record(self, args, value):
-    self.cache[self.extractor(args)] = value
+    self.set_key(value, *self.extractor(args))
+
+  def dump(self):
+    """Returns the cached results, for `load`."""
+    return (self.recent, self.older)
+
+  def load(self, state):
+    self.recent, self.older = state
 
 class DBMemoizer (Memoizer):
-  def __init__(self, fn):
-    Memoizer.__init__(self, fn, lambda args: args[1:])
+  def __init__(self, fn, size=None):
+    Memoizer.__init__(self, fn, lambda args: args[1:], size)
+
+def report_memoizer_stats():
+  print "--------------------------------------------------------"
+  print "MEMOIZER STATS"
+  memos = [m for m in Memoizer.instances if m.hits or m.misses]
+  memos.sort(key=lambda m: m.misses, reverse=True)
+  for m in memos:
+    print ("%-32s size %7d/%-7d hits %9d misses %8d (%.1f%% hits) "
+           "evicted %8d" %
+           (m.name, len(m), m.size, m.hits, m.misses,
+            100.0 * m.hits / (m.hits + m.misses), m.evictions))
@@ -5,6 +5,11 @@ import mako.lookup
 import os
 import os.path
 import datetime
+import hashlib
+import json
+import multiprocessing
+import re
+import shutil
 import scload
 import query
 import config
@@ -22,37 +27,109 @@ def handle_unicode(value):
   return unicode(value)
 
 TEMPLATE_DIR = os.path.abspath('templates')
-MAKO_LOOKUP = mako.lookup.TemplateLookup(
-  directories = [ TEMPLATE_DIR ],
-  output_encoding = 'utf-8', encoding_errors = 'replace',
-  imports = [ "import pagedefs" ],
-  default_filters = [ "pagedefs.handle_unicode" ])
+
+def make_lookup():
+  return mako.lookup.TemplateLookup(
+    directories = [ TEMPLATE_DIR ],
+    module_directory = config.TEMPLATE_CACHE_DIR,
+    output_encoding = 'utf-8', encoding_errors = 'replace',
+    imports = [ "import pagedefs" ],
+    default_filters = [ "pagedefs.handle_unicode" ])
+
+MAKO_LOOKUP = make_lookup()
 
 force_locale = html.force_locale
 
+def warm_templates():
+  """Compile every template into the template cache."""
+  if not config.TEMPLATE_CACHE_DIR:
+    warn("No template-cache directory is configured; nothing to do.")
+    return
+  for f in sorted(os.listdir(TEMPLATE_DIR)):
+    if f.endswith('.mako'):
+      info("Compiling %s" % f)
+      MAKO_LOOKUP.get_template(f)
+
+# Hashes of the pages as last written, without their update times, so that
+# pages that haven't changed aren't rewritten. These are kept in HASH_FILE in
+# the scoring directory between runs.
+HASH_FILE = '.page-hashes.json'
+R_UPDATE_TIME = re.compile(r'<div class="updatetime">.*?</div>', re.S)
+PAGE_HASHES = None
+page_hashes_changed = False
+
+def page_hashes():
+  global PAGE_HASHES
+  if PAGE_HASHES is None:
+    PAGE_HASHES = { }
+    path = os.path.join(config.SCORE_FILE_DIR, HASH_FILE)
+    if os.path.exists(path):
+      try:
+        f = open(path)
+        try:
+          PAGE_HASHES = json.load(f)
+        finally:
+          f.close()
+      except ValueError, e:
+        warn("Ignoring unreadable page hashes in %s: %s" % (path, e))
+  return PAGE_HASHES
+
+def record_page_hashes(hashes):
+  global page_hashes_changed
+  if hashes:
+    page_hashes().update(hashes)
+    page_hashes_changed = True
+
+def save_page_hashes():
+  global page_hashes_changed
+  if not page_hashes_changed:
+    return
+  path = os.path.join(config.SCORE_FILE_DIR, HASH_FILE)
+  write_atomically(path, json.dumps(page_hashes()))
+  page_hashes_changed = False
+
+def write_atomically(target, text):
+  """Write to a temporary file and rename it into place, so that the file is
+  never seen half-written (and concurrent writes can't mix)."""
+  tmp = "%s.%d.tmp" % (target, os.getpid())
+  try:
+    f = open(tmp, 'w')
+    try:
+      f.write(text)
+    finally:
+      f.close()
+    os.rename(tmp, target)
+  finally:
+    if os.path.exists(tmp):
+      os.unlink(tmp)
+
 def render(c, page, dest=None, pars=None):
   """Given a db context and a .mako template (without the .mako extension)
   renders the template and writes it back to <page>.html in the tourney
-  scoring directory. Setting dest overrides the destination filename."""
+  scoring directory. Setting dest overrides the destination filename. The
+  file is left alone if only its update time would change."""
 
   force_locale()
 
   if not pars or not pars.has_key('quiet'):
     info("Rendering " + page)
-  target = os.path.join(config.SCORE_FILE_DIR, "%s.html" % (dest or page))
+  name = dest or page
+  target = os.path.join(config.SCORE_FILE_DIR, "%s.html" % name)
   t = MAKO_LOOKUP.get_template(page + '.mako')
-  try:
-    f = open(target, 'w')
 
-    pars = pars or { }
-    pars['cursor'] = c
+  pars = pars or { }
+  pars['cursor'] = c
 
-    try:
-      f.write( t.render( attributes = pars ) )
-    finally:
-      f.close()
+  try:
+    text = t.render( attributes = pars )
   except ScoringException, e:
     error("Error generating page %s: %s" % (page, e))
+    return
+  digest = hashlib.md5(R_UPDATE_TIME.sub('', text)).hexdigest()
+  if page_hashes().get(name) == digest and os.path.exists(target):
+    return
+  write_atomically(target, text)
+  record_page_hashes({ name: digest })
 
 def render_pages(c):
   maybe_copy_css()
@@ -60,14 +137,150 @@ def render_pages(c):
     render(c, p[0])
 
 def render_player_pages(c):
-  for p in query.find_all_players(c):
-    player_page(c, p)
+  player_pages(c, query.find_all_players(c))
+
+def player_dest(player):
+  return os.path.join(config.PLAYER_BASE, player.lower())
 
-def player_page(c, player):
+def player_page(c, player, data=None):
+  """Render a player's page. `data` is the player's entry from
+  query.player_page_data, if it has already been fetched."""
   info("Updating player page for %s" % player)
   render(c, 'player',
-         dest = os.path.join(config.PLAYER_BASE, player.lower()),
-         pars = { 'player' : player, 'quiet': True })
+         dest = player_dest(player),
+         pars = { 'player' : player, 'quiet': True, 'data': data })
+
+def player_page_batch(c, players):
+  """Render pages for a list of players, fetching their data in bulk."""
+  for i in range(0, len(players), query.PLAYER_DATA_CHUNK):
+    chunk = players[i:i + query.PLAYER_DATA_CHUNK]
+    data = query.player_page_data(c, chunk)
+    for p in chunk:
+      player_page(c, p, data.get(p.lower()))
+
+# With --render-workers, player pages are rendered by a pool of worker
+# processes, each with its own db connection and template lookup, in batches
+# of RENDER_BATCH_SIZE players. Nothing waits for the renders except
+# `wait_for_renders`, which is called when pages are flushed at shutdown.
+# A player is only in one batch at a time: one that is due again while its
+# batch is still out is held back, and sent again once that batch is
+# collected, so that an older batch can't overwrite a newer page.
+RENDER_BATCH_SIZE = 50
+render_pool = None
+render_results = [ ] # (players, async result), in the order they were sent
+RENDERING = set() # players in batches that haven't been collected
+RENDER_AGAIN = set() # players in RENDERING that are due again
+worker_cursor = None
+
+def init_render_worker():
+  global worker_cursor, MAKO_LOOKUP
+  scload.init_parse_worker()
+  db = scload.connect_db(password=scload.OPT.mysql_pass,
+                         host=scload.OPT.mysql_host)
+  worker_cursor = scload.set_active_cursor(db.cursor(), db)
+  MAKO_LOOKUP = make_lookup()
+
+def render_player_batch(players, hashes):
+  """Render a batch of player pages in a render worker. `hashes` are the
+  main process's page hashes for these players; returns the new ones."""
+  global PAGE_HASHES
+  # end the last transaction, so that the pages reflect the latest commit.
+  worker_cursor.db.commit()
+  # the main process flushes these when a new race or class turns up, but the
+  # worker has its own copies.
+  for m in (query.db_races, query.current_races,
+            query.db_classes, query.current_classes):
+    m.flush()
+  PAGE_HASHES = hashes
+  data = query.player_page_data(worker_cursor, players)
+  for p in players:
+    try:
+      player_page(worker_cursor, p, data.get(p.lower()))
+    except Exception, e:
+      error("Error rendering player page for %s: %s" % (p, e))
+  return PAGE_HASHES
+
+def player_pages(c, players):
+  """Render the pages for a list of players, in the background if there are
+  render workers."""
+  global render_pool
+  if scload.OPT.render_workers < 1:
+    player_page_batch(c, list(players))
+    return
+  if render_pool is None:
+    info("Rendering player pages with %d worker processes."
+         % scload.OPT.render_workers)
+    render_pool = multiprocessing.Pool(scload.OPT.render_workers,
+                                       init_render_worker)
+  players = list(players)
+  for p in collect_renders():
+    if p not in players:
+      players.append(p)
+  RENDER_AGAIN.update([p for p in players if p in RENDERING])
+  send_renders([p for p in players if p not in RENDERING])
+
+def send_renders(players):
+  hashes = page_hashes()
+  for i in range(0, len(players), RENDER_BATCH_SIZE):
+    batch = players[i:i + RENDER_BATCH_SIZE]
+    dests = [player_dest(p) for p in batch]
+    RENDERING.update(batch)
+    render_results.append((batch, render_pool.apply_async(render_player_batch,
+                              (batch, dict([(d, hashes[d]) for d in dests
+                                            if d in hashes])))))
+
+def collect_renders(block=False):
+  """Record (and check) the results of finished batches, in the order they
+  were sent; with `block`, wait for all of them. Returns the players from
+  those batches that are due again."""
+  again = [ ]
+  while render_results and (block or render_results[0][1].ready()):
+    batch, r = render_results.pop(0)
+    RENDERING.difference_update(batch)
+    again.extend([p for p in batch if p in RENDER_AGAIN])
+    RENDER_AGAIN.difference_update(batch)
+    record_page_hashes(r.get())
+  return again
+
+def wait_for_renders():
+  """Wait for any player pages being rendered in the background, shut down
+  the render workers, and save the page hashes."""
+  global render_pool, render_results
+  if render_pool is None:
+    return
+  info("Waiting for %d batches of player pages." % len(render_results))
+  try:
+    again = collect_renders(True)
+    while again:
+      send_renders(again)
+      again = collect_renders(True)
+    render_pool.close()
+  finally:
+    render_results = [ ]
+    RENDERING.clear()
+    RENDER_AGAIN.clear()
+    render_pool.terminate()
+    render_pool.join()
+    render_pool = None
+    save_page_hashes()
+
+# Fragment cache. Summary pages keep blocks of rendered html (or the query
+# results behind them) by name, stamped with change counts for the tables they
+# are built from, and reuse them until one of those tables changes (see
+# `note_change`).
+TABLE_CHANGES = { }
+FRAGMENTS = { }
+
+def fragment(name, tables, fn):
+  """Return the cached value of fragment `name` if none of `tables` has
+  changed since it was made, otherwise call fn() to remake it."""
+  stamp = tuple([TABLE_CHANGES.get(t, 0) for t in tables])
+  cached = FRAGMENTS.get(name)
+  if cached is not None and cached[0] == stamp:
+    return cached[1]
+  value = fn()
+  FRAGMENTS[name] = (stamp, value)
+  return value
 
 def player_pages_exist():
   player_dir = config.PLAYER_FILE_DIR
@@ -85,146 +298,137 @@ def player_pages_exist():
   os.makedirs(config.PLAYER_FILE_DIR)
   return False
 
+first_run = True
+
+# Each page lists the changes it depends on, with the longest time (in
+# minutes) that the page may go without showing such a change. A change is
+# named by a table, or by a slice of a table as "table:slice" (a change to a
+# slice is also a change to its table). The writers in stats.py report changes
+# with `note_change`, and a page is rendered once the earliest deadline of its
+# unrendered changes comes due.
 PAGE_DEFS = [
-  [ 'overview' ], #
-  [ 'top-N' ], #
-  [ 'best-players-total-score', 200 ], #
-  [ 'top-combo-scores' ], #
-  [ 'combo-scoreboard' ], #
-  [ 'all-players', 200 ], #
-  [ 'killers' ], #
-  [ 'gkills' ], #
-  [ 'winners' ], #
-  [ 'fastest-wins-turns' ], #
-  [ 'fastest-wins-time' ], #
-  [ 'streaks' ], #
-  [ 'recent' ], #
-  [ 'per-day', 500 ], #
-  [ 'per-day-monthly' ], #
+  [ 'overview', { 'wins': 5, 'top_games:top': 5, 'streaks': 10,
+                  'top_combo_scores': 30, 'ziggurats': 30,
+                  'low_xl_rune_finds': 30 } ],
+  [ 'top-N', { 'top_games': 30 } ],
+  [ 'best-players-total-score', { 'players': 240, 'players:scores': 30,
+                                  'players:wins': 10 } ],
+  [ 'top-combo-scores', { 'top_combo_scores': 30 } ],
+  [ 'combo-scoreboard', { 'top_combo_scores': 30, 'top_species_scores': 30,
+                          'top_class_scores': 30 } ],
+  [ 'all-players', { 'players': 240, 'players:scores': 30,
+                     'players:wins': 10 } ],
+  [ 'killers', { 'top_killers': 30 } ],
+  [ 'gkills', { 'ghost_victims': 30 } ],
+  [ 'winners', { 'wins': 5 } ],
+  [ 'fastest-wins-turns', { 'wins': 30 } ],
+  [ 'fastest-wins-time', { 'wins': 30 } ],
+  [ 'streaks', { 'streaks': 10 } ],
+  [ 'recent', { 'all_recent_games': 10 } ],
+  [ 'per-day', { 'per_day_stats': 120 } ],
+  [ 'per-day-monthly', { 'per_day_stats': 30 } ],
 ]
 
-DIRTY_PAGES = { }
-DIRTY_PLAYERS = { }
-
-# Pages update at least once in 30 minutes if dirty.
-# TODO: the time it takes for a tick is really dependent on how much the loop
-# does. The tick_amount calculation is a hacky way of getting around this,
-# where the original design assumed that the loop did no io, so a tick was
-# equivalent to the sleep time. Is there a better way?
-DEFAULT_DIRTY_THRESHOLD = 30
-PLAYER_DIRTY_THRESHOLD = 30
-
-first_run = True
+# change -> [ (page, max staleness) ]
+PAGE_DEPENDENTS = { }
+for p in PAGE_DEFS:
+  for dep, minutes in p[1].items():
+    PAGE_DEPENDENTS.setdefault(dep, [ ]).append(
+      (p[0], datetime.timedelta(minutes=minutes)))
 
-last_tick_time = None
-
-def tick_dirty():
-  global last_tick_time
-  if last_tick_time is None:
-    tick_amount = 1
-    info("Ticking all pages by %d", tick_amount)
-  else:
-    td = datetime.datetime.now() - last_tick_time
-    tick_amount = max(min(td.total_seconds() / 60, 30), 1)
-    info("Ticking all pages by %d (last tick: %d seconds)",
-                                              tick_amount, td.total_seconds())
+# A player's page shows a win by the next page build, and anything else within
+# PLAYER_MAX_STALENESS minutes.
+PLAYER_MAX_STALENESS = 30
 
-  def tick_thing(things):
-    for p in things.keys():
-      v = things[p]
-      if v['dirtiness']:
-        v['dirtiness'] += tick_amount
+# page or player -> time by which it should be rendered.
+DIRTY_PAGES = { }
+DIRTY_PLAYERS = { }
 
-  tick_thing(DIRTY_PAGES)
-  tick_thing(DIRTY_PLAYERS)
-  last_tick_time = datetime.datetime.now()
+def due_by(things, thing, deadline):
+  if thing not in things or deadline < things[thing]:
+    things[thing] = deadline
+
+def note_change(*changes):
+  """Record changes to tables or table slices (see PAGE_DEFS)."""
+  now = datetime.datetime.now()
+  for change in changes:
+    table = change.split(':')[0]
+    TABLE_CHANGES[table] = TABLE_CHANGES.get(table, 0) + 1
+    keys = table == change and [ table ] or [ change, table ]
+    for k in keys:
+      for page, staleness in PAGE_DEPENDENTS.get(k, ()):
+        due_by(DIRTY_PAGES, page, now + staleness)
+
+def dirty_player(p, minutes = PLAYER_MAX_STALENESS):
+  due_by(DIRTY_PLAYERS, p,
+         datetime.datetime.now() + datetime.timedelta(minutes=minutes))
 
 def fully_dirty():
-  def dirty_thing(things):
-    for p in things.keys():
-      v = things[p]
-      v['dirtiness'] = v['threshold']
-  dirty_thing(DIRTY_PAGES)
-  dirty_thing(DIRTY_PLAYERS)
-
-def init_dirty():
-  global last_tick_time
-  last_tick_time = datetime.datetime.now()
+  now = datetime.datetime.now()
   for p in PAGE_DEFS:
-    threshold = len(p) == 1 and DEFAULT_DIRTY_THRESHOLD or p[1]
-    DIRTY_PAGES[p[0]] = { 'dirtiness': 0, 'threshold': threshold }
-
-def dirty_player(p, increment = PLAYER_DIRTY_THRESHOLD + 1):
-  if not DIRTY_PLAYERS.has_key(p):
-    DIRTY_PLAYERS[p] = { 'dirtiness': 0, 'threshold': PLAYER_DIRTY_THRESHOLD }
-  DIRTY_PLAYERS[p]['dirtiness'] += increment
-  debug("player_DIRTY: %s (+%d) => %d" % (p, increment, DIRTY_PLAYERS[p]['dirtiness']))
-
-def dirty_page(p, increment = DEFAULT_DIRTY_THRESHOLD + 1):
-  if first_run: # TODO: get rid of this
-    return
-  DIRTY_PAGES[p]['dirtiness'] += increment
-  debug("page_DIRTY: %s (+%d) => %d" % (p, increment, DIRTY_PAGES[p]['dirtiness']))
-
-def dirty_pages(*pages):
-  for p in pages:
-    dirty_page(p)
+    DIRTY_PAGES[p[0]] = now
+  for p in DIRTY_PLAYERS.keys():
+    DIRTY_PLAYERS[p] = now
 
 def mark_all_clean():
-  for v in DIRTY_PAGES.values():
-    v['dirtiness'] = 0
+  DIRTY_PAGES.clear()
   DIRTY_PLAYERS.clear()
 
 def rebuild(c):
   render(c, 'index')
   render_pages(c)
   mark_all_clean()
+  save_page_hashes()
 
 def rebuild_pages(c):
   render_player_pages(c)
   DIRTY_PLAYERS.clear()
+  save_page_hashes()
 
 def initialize_pages(c):
   global first_run
-  init_dirty()
   first_run = False
   if scload.OPT.rebuild_player:
     player_args = scload.OPT.rebuild_player.split(",")
     for p in player_args:
-      dirty_player(p)
+      dirty_player(p, 0)
   else:
     render(c, 'index')
     fully_dirty() # set all pages dirty, and any players that have been touched
   if scload.OPT.rebuild_players or not player_pages_exist():
     rebuild_pages(c)
 
-def apply_to_dirty(c, things, fn, wipe=False):
-  done = []
-  for p in things.keys():
-    v = things[p]
-    if v['dirtiness'] >= v['threshold']:
-      fn(c, p)
-      done.append(p)
-      v['dirtiness'] = 0
-  if wipe:
-    for d in done:
-      del things[d]
+def take_dirty(things):
+  """Return the things that are due to be rendered, and forget them."""
+  now = datetime.datetime.now()
+  done = [p for p, deadline in things.items() if deadline <= now]
+  for d in done:
+    del things[d]
+  return done
+
+def apply_to_dirty(c, things, fn):
+  for p in take_dirty(things):
+    fn(c, p)
 
 def flush_pages(c):
   fully_dirty()
   # don't render summary pages here because it can be too slow
-  apply_to_dirty(c, DIRTY_PLAYERS, player_page, wipe=True)
+  try:
+    player_pages(c, take_dirty(DIRTY_PLAYERS))
+  finally:
+    wait_for_renders()
 
 def incremental_build(c):
-  global first_run
   if scload.OPT.load_only:
     info("Skipping incremental page builds because of command line options.")
     return
 
+  query.new_page_pass()
   if first_run:
     initialize_pages(c)
   apply_to_dirty(c, DIRTY_PAGES, render)
-  apply_to_dirty(c, DIRTY_PLAYERS, player_page, wipe=True)
+  player_pages(c, take_dirty(DIRTY_PLAYERS))
+  save_page_hashes()
 
 def maybe_copy_css():
   """Copy score.css to the destination directory if required."""
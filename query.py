@@ -12,7 +12,7 @@ from scload import query_first_col, query_first_def, game_is_win
 import crawl
 import config
 import crawl_utils
-from memoizer import DBMemoizer
+from memoizer import DBMemoizer, PLAYER_CACHE_SIZE
 from crawl_utils import linked_text, human_number, player_link
 from morgue.util import morgue_link
 import uniq
@@ -86,7 +86,7 @@ def row_to_xdict(row):
 def xdict_rows(rows):
   return [row_to_xdict(x) for x in rows]
 
-@DBMemoizer
+@DBMemoizer.sized(PLAYER_CACHE_SIZE)
 def canonicalize_player_name(c, player):
   row = query_row(c, '''SELECT name FROM players WHERE name = %s''',
                   player)
@@ -222,21 +222,45 @@ def player_best_first_last(c, player):
   q = " UNION ALL ".join(["(" + x + ")" for x in q])
   return xdict_rows(query_rows(c, q, player, player, player))
 
+def players_best_first_last(c, where):
+  """player_best_first_last for all the players matching `where` (a
+  condition on `players p`), in three queries rather than one per player.
+  Returns a dict of lowercased player name -> [best, first, last] games."""
+  def player_games(table, extra=''):
+    rows = query_rows(c, "SELECT " + logfields_prefixed('g.') +
+                         " FROM players p, " + table + " g" +
+                         " WHERE g.name = p.name AND (" + where + ")" + extra)
+    games = { }
+    for g in xdict_rows(rows):
+      games.setdefault(g['name'].lower(), g)
+    return games
+  best = player_games('player_best_games',
+                      ''' AND g.sc = (SELECT MAX(b.sc) FROM player_best_games b
+                                       WHERE b.name = g.name)''')
+  first = player_games('player_first_games')
+  last = player_games('player_last_games')
+  return dict([(n, [best[n], first[n], last[n]]) for n in best.keys()
+               if n in first and n in last])
+
+BEST_PLAYERS_WHERE = '''p.total_score > 500 and
+                        (p.last_game_end >= curdate() - interval 1 week
+                         or p.games_played > 40
+                         or p.games_won > 0
+                         or p.total_score > 100000)'''
+
 def best_players_by_total_score(c):
   rows = query_rows(c, '''SELECT name, games_played, games_won,
                                  total_score, best_score,
                                  first_game_start, last_game_end
-                            FROM players
-                            WHERE total_score > 500 and
-                                  (last_game_end >= curdate() - interval 1 week
-                                   or games_played > 40
-                                   or games_won > 0
-                                   or total_score > 100000)
+                            FROM players p
+                            WHERE ''' + BEST_PLAYERS_WHERE + '''
                           ORDER BY total_score DESC''')
+  best_first_last = players_best_first_last(c, BEST_PLAYERS_WHERE)
   res = []
   for r in rows:
     rl = list(r)
-    games = player_best_first_last(c, rl[0])
+    games = (best_first_last.get(rl[0].lower())
+             or player_best_first_last(c, rl[0]))
     rl[4] = linked_text(games[0], morgue_link, human_number(rl[4]))
     rl[5] = linked_text(games[1], morgue_link, rl[5])
     rl[6] = linked_text(games[2], morgue_link, rl[6])
@@ -246,8 +270,8 @@ def best_players_by_total_score(c):
                + [avg_score] + list(rl[5:]))
   return res
 
-def fixup_player_stats(c, rl):
-  games = player_best_first_last(c, rl[0])
+def fixup_player_stats(c, rl, games=None):
+  games = games or player_best_first_last(c, rl[0])
   rl[5] = linked_text(games[0], morgue_link, human_number(rl[5]))
   rl[6] = linked_text(games[1], morgue_link, rl[6])
   rl[7] = linked_text(games[2], morgue_link, rl[7])
@@ -264,16 +288,19 @@ def fixup_player_stats(c, rl):
            'first_game': rl[6],
            'last_game': rl[7] }
 
+ALL_PLAYERS_WHERE = '''p.last_game_end >= curdate() - interval 1 year
+                       or p.games_played > 40
+                       or p.games_won > 0
+                       or p.total_score > 100000'''
+
 def all_player_stats(c):
   rows = query_rows(c, '''SELECT name, games_played, games_won,
                                  total_score, best_xl, best_score,
                                  first_game_start, last_game_end
-                            FROM players
-                            WHERE last_game_end >= curdate() - interval 1 year
-                                  or games_played > 40
-                                  or games_won > 0
-                                  or total_score > 100000
+                            FROM players p
+                            WHERE ''' + ALL_PLAYERS_WHERE + '''
                            ORDER BY name''')
+  best_first_last = players_best_first_last(c, ALL_PLAYERS_WHERE)
 
   def flatten_row(r):
     return [r[s] for s in
@@ -283,7 +310,8 @@ def all_player_stats(c):
   res = []
   for r in rows:
     rl = list(r)
-    res.append(flatten_row(fixup_player_stats(c, rl)))
+    res.append(flatten_row(fixup_player_stats(c, rl,
+                                    best_first_last.get(rl[0].lower()))))
   return res
 
 def top_combo_scores(c):
@@ -338,21 +366,38 @@ def find_streak_breaker(c, sid):
     query_row(c, game_select_from('streak_breakers') + " WHERE streak_id = %s",
               sid))
 
+def find_streak_breakers(c, sids, chunk=1000):
+  """Returns a dict of streak id -> breaking game for the given streak ids.
+  Streaks without a breaker are left out."""
+  sids = list(sids)
+  breakers = { }
+  for i in range(0, len(sids), chunk):
+    ids = sids[i:i + chunk]
+    rows = query_rows(c, "SELECT streak_id, " + scload.LOG_DB_SCOLUMNS +
+                         " FROM streak_breakers WHERE streak_id IN (" +
+                         ",".join(["%s"] * len(ids)) + ")",
+                      *ids)
+    for r in rows:
+      breakers[r[0]] = row_to_xdict(r[1:])
+  return breakers
+
 def extract_streaks(c, query, streak_filter=None, max_streaks=None):
-  sgames = query.rows(c)
+  return streaks_from_rows(c, query.rows(c), streak_filter, max_streaks)
+
+def streaks_from_rows(c, sgames, streak_filter=None, max_streaks=None):
+  if streak_filter:
+    sgames = [g for g in sgames if streak_filter(g)]
+  # Grab the breakers for all the streaks that are not active:
+  breakers = find_streak_breakers(c, set([g[0] for g in sgames if not g[5]]))
+
   # Streak table: ngames, active, all games in streak.
   streak_id_map = { }
   def register_game(g):
-    if streak_filter and not streak_filter(g):
-      return
     sid = g[0]
     if not streak_id_map.has_key(sid):
-      breaker = ''
-      # If the streak is not active, grab the breaker:
-      if not g[5]:
-        breaker = find_streak_breaker(c, sid)
-        if breaker:
-          breaker = linked_text(breaker, morgue_link, breaker['charabbr'])
+      breaker = breakers.get(sid, '')
+      if breaker:
+        breaker = linked_text(breaker, morgue_link, breaker['charabbr'])
       streak_id_map[sid] = {'ngames': g[2],
                             'player': g[1],
                             'start': g[3],
@@ -385,6 +430,13 @@ def extract_streaks(c, query, streak_filter=None, max_streaks=None):
   return max_streaks and streaks[:max_streaks] or streaks
 
 def all_streaks(c, max_per_player=10, max_streaks=None, active_streaks=False):
+  """Returns the list of streaks for all players, longest first. Several
+  pages show these, so the list is kept until the next page build pass (see
+  `new_page_pass`); don't modify it."""
+  return cached_all_streaks(c, max_per_player, max_streaks, active_streaks)
+
+@DBMemoizer
+def cached_all_streaks(c, max_per_player, max_streaks, active_streaks):
   logf = logfields_prefixed('g.')
 
   extra = ''
@@ -431,11 +483,14 @@ def player_recent_games(c, player, limit=15):
                     limit = limit)
 
 def player_top_thing_scores(c, player, table, label):
+  return top_thing_scores(find_games(c, table, name=player, sort_max='sc'),
+                          label)
+
+def top_thing_scores(games, label):
   return [(linked_text(g, morgue_link, g[label])
            + (game_is_win(g) and '*' or ''),
            g['sc'])
-          for g in
-          find_games(c, table, name=player, sort_max='sc')]
+          for g in games]
 
 def curry_player_top_thing(table, label):
   return lambda c, player: player_top_thing_scores(c, player, table, label)
@@ -556,33 +611,79 @@ def best_ziggurats(c, limit=6):
                             FROM ziggurats
                           ORDER BY deepest DESC, zig_time DESC''')]
 
-@DBMemoizer
-def count_players_per_day(c, day):
-  return query_first(c,
-                     '''SELECT COUNT(*) FROM date_players
-                                       WHERE which_day = %s''',
-                     day)
+def string_date(d):
+  assert(isinstance(d, datetime.datetime))
+  return d.strftime('%Y%m%d')
 
-@DBMemoizer
-def winners_for_day(c, day):
-  return query_rows(c,
-                    '''SELECT player, wins FROM date_players
-                        WHERE which_day = %s AND wins > 0
-                        ORDER BY wins DESC, player''',
-                    day)
+# Per-day player counts and winners, and per-month player counts, from
+# date_players. These are loaded for every day at once the first time they are
+# needed; after that only the days handed to `touch_days` (by
+# stats.PerDayStats, once it has written them) are reloaded.
+DAY_PLAYERS = { }
+DAY_WINNERS = { }
+MONTH_PLAYERS = { }
+touched_days = set()
+day_stats_loaded = False
+
+def touch_days(days):
+  touched_days.update(days)
+
+def _in_clause(column, values):
+  return column + " IN (" + ",".join(["%s"] * len(values)) + ")"
+
+def load_day_stats(c, days=None):
+  """Load the player counts and winners for `days` (strings like
+  '20200131'), and the player counts for their months, or for all days if
+  `days` is None."""
+  if days is None:
+    day_where = month_where = ''
+    day_args = month_args = [ ]
+  else:
+    days = list(days)
+    if not days:
+      return
+    day_args = days
+    month_args = list(set([d[:6] for d in days]))
+    day_where = " AND " + _in_clause('which_day', day_args)
+    month_where = " WHERE " + _in_clause('which_month', month_args)
+    for d in days:
+      DAY_PLAYERS.pop(d, None)
+      DAY_WINNERS.pop(d, None)
+
+  for day, n in query_rows(c, '''SELECT which_day, COUNT(*) FROM date_players
+                                 WHERE 1''' + day_where +
+                              " GROUP BY which_day", *day_args):
+    DAY_PLAYERS[string_date(day)] = n
+  for day, player, wins in query_rows(c,
+                              '''SELECT which_day, player, wins
+                                   FROM date_players
+                                  WHERE wins > 0''' + day_where +
+                              " ORDER BY which_day, wins DESC, player",
+                              *day_args):
+    DAY_WINNERS.setdefault(string_date(day), [ ]).append((player, wins))
+  for month, n in query_rows(c, '''SELECT which_month, COUNT(DISTINCT player)
+                                     FROM date_players''' + month_where +
+                                " GROUP BY which_month", *month_args):
+    MONTH_PLAYERS[month] = n
+
+def refresh_day_stats(c):
+  """Bring the cached per-day stats up to date."""
+  global day_stats_loaded
+  if not day_stats_loaded:
+    touched_days.clear()
+    load_day_stats(c)
+    day_stats_loaded = True
+  elif touched_days:
+    days = list(touched_days)
+    touched_days.clear()
+    load_day_stats(c, days)
 
 def per_day_stats(c, day, fullday, games_ended, games_won):
-  distinct_players = count_players_per_day(c, day)
-  winners = winners_for_day(c, day)
   return {'day': fullday.strftime('%Y-%m-%d'),
           'games': games_ended,
-          'players': distinct_players,
+          'players': DAY_PLAYERS.get(day, 0),
           'wins': games_won,
-          'winners': winners}
-
-def string_date(d):
-  assert(isinstance(d, datetime.datetime))
-  return d.strftime('%Y%m%d')
+          'winners': DAY_WINNERS.get(day, [ ])}
 
 def counted_thing(thing, n):
   if n == 1:
@@ -597,10 +698,7 @@ def fixup_winners(winners):
 
 def fixup_month(c, month):
   mwin = month['winners'].items()
-  month['players'] = query_first(c, '''SELECT COUNT(DISTINCT player)
-                                        FROM date_players
-                                       WHERE which_month = %s''',
-                                 month['month'].replace('-', ''))
+  month['players'] = MONTH_PLAYERS.get(month['month'].replace('-', ''), 0)
   def sort_winners(a, b):
     if a[1] != b[1]:
       return int(b[1] - a[1])
@@ -621,6 +719,7 @@ def date_stats(c, restricted=False):
     dates = query_rows(c,
                      '''SELECT which_day, games_ended, games_won
                          FROM per_day_stats ORDER BY which_day DESC''')
+  refresh_day_stats(c)
   result = list()
   # TODO: if one of these queries (likely the monthly one) returns a completely
   # empty list, fill in the dates?
@@ -718,24 +817,28 @@ def current_races(c):
   return races
 
 def player_get_stats(c, player):
-  stats = { }
-  rows = query_rows(c, '''SELECT charabbr, games_played, best_xl, wins
+  rows = query_rows(c, '''SELECT name, charabbr, games_played, best_xl, wins
                             FROM player_char_stats
                            WHERE name = %s''', player)
+  return char_stats_from_rows(rows)
+
+def char_stats_from_rows(rows):
+  stats = { }
   for r in rows:
-    stats[r[0].lower()] = { 'games': r[1],
-                            'xl': r[2],
-                            'wins': r[3] }
+    stats[r[1].lower()] = { 'games': r[2],
+                            'xl': r[3],
+                            'wins': r[4] }
   return stats
 
-def player_stats_matrix(c, player):
+def player_stats_matrix(c, player, stats=None):
   races = db_races(c)
   classes = db_classes(c)
   obs_races = obsolete_races()
   obs_classes = obsolete_classes()
 
   rows = []
-  stats = player_get_stats(c, player)
+  if stats is None:
+    stats = player_get_stats(c, player)
 
   rows.append(['&nbsp;'] + [c in obs_classes and c + "*" or c for c in classes]
                   + ['&nbsp;&nbsp;', '&nbsp;'])
@@ -808,3 +911,101 @@ def overall_player_stats(c, player):
     raise crawl_utils.ScoringException("Non-existent player '%s': interrupt during bulk import?" % player)
   else:
     return fixup_player_stats(c, list(row))
+
+# Player pages are usually rendered for many players at once (dirty players,
+# or a full rebuild), so player_page_data fetches the data for a whole list of
+# players with one `name IN (...)` query per kind of data, PLAYER_DATA_CHUNK
+# players at a time, rather than the ten or so queries per player of the
+# single-player functions above.
+PLAYER_DATA_CHUNK = 500
+PLAYER_PAGE_STREAKS = 10
+PLAYER_PAGE_RECENT_GAMES = 15
+
+def _name_in(names):
+  return "name IN (" + ",".join(["%s"] * len(names)) + ")"
+
+def _group_by_player(items, name_fn):
+  groups = { }
+  for x in items:
+    groups.setdefault(name_fn(x).lower(), []).append(x)
+  return groups
+
+def _player_games(c, table, names, order_by):
+  rows = query_rows(c, game_select_from(table) + "WHERE " + _name_in(names)
+                       + " ORDER BY " + order_by,
+                    *names)
+  return _group_by_player(xdict_rows(rows), lambda g: g['name'])
+
+def _player_page_data_chunk(c, names):
+  players = query_rows(c, '''SELECT name, games_played, games_won,
+                                    total_score, best_xl, best_score,
+                                    first_game_start, last_game_end
+                               FROM players WHERE ''' + _name_in(names),
+                       *names)
+  best = _player_games(c, 'player_best_games', names, 'sc DESC')
+  first = _player_games(c, 'player_first_games', names, 'id')
+  last = _player_games(c, 'player_last_games', names, 'id')
+  wins = _player_games(c, 'wins', names, 'end_time')
+  recent = _player_games(c, 'player_recent_games', names, 'end_time DESC')
+  top_things = [ (key, _player_games(c, table, names, 'sc DESC'), label)
+                 for key, table, label in
+                 [ ('combo_highscores', 'top_combo_scores', 'charabbr'),
+                   ('species_highscores', 'top_species_scores', 'raceabbr'),
+                   ('class_highscores', 'top_class_scores', 'clsabbr') ] ]
+  char_stats = _group_by_player(
+    query_rows(c, '''SELECT name, charabbr, games_played, best_xl, wins
+                       FROM player_char_stats WHERE ''' + _name_in(names),
+               *names),
+    lambda r: r[0])
+  streaks = _group_by_player(
+    Query("SELECT s.id, s.player, s.ngames, s.start_game_time, " +
+          "s.end_game_time, s.active, " + logfields_prefixed('g.') +
+          ''' FROM streaks s, streak_games g
+             WHERE s.player IN (''' + ",".join(["%s"] * len(names)) + ''')
+               AND g.name = s.player
+               AND g.end_time >= s.start_game_time
+               AND g.end_time <= s.end_game_time
+          ORDER BY s.ngames DESC, s.id''', *names).rows(c),
+    lambda r: r[1])
+
+  data = { }
+  for row in players:
+    n = row[0].lower()
+    if not (best.get(n) and first.get(n) and last.get(n)):
+      continue # a partial load; leave it to player_page_context to complain
+    games = [ best[n][0], first[n][0], last[n][0] ]
+    d = { 'ostats': fixup_player_stats(c, list(row), games),
+          'wins': wins.get(n, []),
+          'streaks': streaks_from_rows(c, streaks.get(n, []),
+                                       max_streaks=PLAYER_PAGE_STREAKS),
+          'recent_games': recent.get(n, [])[:PLAYER_PAGE_RECENT_GAMES],
+          'stats': player_stats_matrix(c, row[0],
+                                       char_stats_from_rows(
+                                         char_stats.get(n, []))) }
+    for key, games, label in top_things:
+      d[key] = top_thing_scores(games.get(n, []), label)
+    data[n] = d
+  return data
+
+def player_page_data(c, players):
+  """Returns everything that the player page shows for each of the given
+  players, as a dict of lowercased player name -> dict of values. Players
+  that aren't in the db are left out."""
+  players = list(players)
+  data = { }
+  for i in range(0, len(players), PLAYER_DATA_CHUNK):
+    data.update(_player_page_data_chunk(c,
+                                        players[i:i + PLAYER_DATA_CHUNK]))
+  return data
+
+def player_page_context(c, player):
+  """The player page data (see player_page_data) for a single player."""
+  data = player_page_data(c, [player]).get(player.lower())
+  if data is None:
+    raise crawl_utils.ScoringException("Non-existent player '%s': interrupt during bulk import?" % player)
+  return data
+
+def new_page_pass():
+  """Forget the query results that are shared between the pages rendered in
+  a single page build pass."""
+  cached_all_streaks.flush()
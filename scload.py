@@ -5,13 +5,24 @@ except ImportError:
 import re
 import os, datetime
 import os.path
-import bisect
+import heapq
+import itertools
+import multiprocessing
+import signal
+import threading
+from collections import deque
 import crawl_utils
+import bulkload
+import xlog.parser
+import xlog.reader
+import xlog.record
+import xlog.fetch
+import xlog.xlog_def
 
 import logging
 from logging import debug, info, warn, error
 
-from memoizer import Memoizer, DBMemoizer
+from memoizer import Memoizer, DBMemoizer, report_memoizer_stats
 
 import ConfigParser
 import imp
@@ -40,6 +51,13 @@ oparser.add_option('--wait', action='store_true', dest='stop_daemon_wait', help=
 oparser.add_option('--run-bans', action='store_true', dest='run_bans', help='Run the ban list, removing any old records from the db and deleting player pages.')
 oparser.add_option('--mysql-pass', help='Specify a password for MySQL connection. By default no password is used.')
 oparser.add_option('--mysql-host', help='Specify a hostname for MySQL connection. Default: localhost.')
+oparser.add_option('--parse-workers', action='store', type='int', dest='parse_workers', metavar='N', help='Parse logfile lines in N worker processes ahead of the chronological merge. Default: parse in the main process.')
+oparser.add_option('--pipeline', action='store_true', dest='pipeline', help='Flush and commit each batch of games on a separate db connection while the next batch is read and parsed.')
+oparser.add_option('--bulk-load', action='store_true', dest='bulk_load', help='When loading into an empty db, load game rows with LOAD DATA LOCAL INFILE and build the read-only indexes at the end.')
+oparser.add_option('--render-workers', action='store', type='int', dest='render_workers', default=0, metavar='N', help='Render player pages in N worker processes, each with its own db connection. Default: render in the main process.')
+oparser.add_option('--mmap', action='store_true', dest='mmap', help='Read logfiles through a memory map, splitting lines in bulk instead of reading them one at a time.')
+oparser.add_option('--warm-templates', action='store_true', dest='warm_templates', help='Compile all the page templates into the template cache and exit.')
+oparser.set_defaults(parse_workers=0)
 OPT, ARGS = oparser.parse_args()
 if OPT.rebuild_players or OPT.rebuild_player is not None:
   OPT.run_once = True
@@ -57,7 +75,36 @@ OLDEST_VERSION = '0.1'
 
 EXTENSION_FILE = 'modules.ext' # ???
 SCORING_DB = 'scoring'
+# Initial number of lines processed between commits. After that, the number
+# is picked by a CommitBatcher so that a batch (processing plus flush) takes
+# about COMMIT_LATENCY seconds, or BULK_COMMIT_LATENCY seconds while more than
+# BULK_REMAINING bytes of logfile are left to read: big batches are cheaper
+# per line to flush, but in the daemon pages should reflect new games quickly.
 COMMIT_INTERVAL = 3000
+MIN_COMMIT_INTERVAL = 500
+MAX_COMMIT_INTERVAL = 100000
+COMMIT_LATENCY = config.CONFIG.get('commit-latency', 5)
+BULK_COMMIT_LATENCY = config.CONFIG.get('bulk-commit-latency', 30)
+BULK_REMAINING = 64 * 1024 * 1024
+
+# Remote logfiles are fetched by this many threads at a time; a source's
+# fetch_timeout overrides FETCH_TIMEOUT (seconds) for its files. A file that
+# hasn't grown in FETCH_IDLE_POLLS fetches is polled less and less often, down
+# to once every FETCH_MAX_IDLE_WAIT + 1 cycles; see xlog/fetch.py.
+FETCH_WORKERS = config.CONFIG.get('fetch-workers', xlog.fetch.DEFAULT_WORKERS)
+FETCH_TIMEOUT = config.CONFIG.get('fetch-timeout', xlog.fetch.DEFAULT_TIMEOUT)
+FETCH_IDLE_POLLS = config.CONFIG.get('fetch-idle-polls',
+                                     xlog.fetch.DEFAULT_IDLE_POLLS)
+FETCH_MAX_IDLE_WAIT = config.CONFIG.get('fetch-max-idle-wait',
+                                        xlog.fetch.DEFAULT_MAX_IDLE_WAIT)
+FETCH_STATE_FILE = os.path.join(xlog.xlog_def.XLOG_LOCAL_STAGE,
+                                '.fetch-state.json')
+
+# With --parse-workers, logfiles are split into byte ranges of about this size
+# (on line boundaries), and each logfile keeps up to PARSE_AHEAD ranges queued
+# in the worker pool ahead of the merge.
+PARSE_CHUNK_SIZE = 1024 * 1024
+PARSE_AHEAD = 2
 
 LISTENERS = [ ]
 TIMERS = [ ]
@@ -191,17 +238,9 @@ class Xlogline:
           "Xlogline time missing from %s:%d: %s" % (filename, offset, xdict)
     self.xdict = xdict
     self.processor = processor
-
-  def __cmp__(self, other):
-    ltime = self.time
-    rtime = other.time
-    # Descending time sort order, so that later dates go first.
-    if ltime > rtime:
-      return -1
-    elif ltime < rtime:
-      return 1
-    else:
-      return 0
+    # Merge order: oldest first; lines with the same time are ordered by
+    # logfile and then by position in the logfile, so this is always unique.
+    self.sort_key = (time, owner.index, offset)
 
   def process(self, cursor):
     self.processor(cursor, self.filename, self.offset, self.xdict)
@@ -217,6 +256,9 @@ class Xlogfile:
     self.proc_op = proc_op
     self.size  = None
     self.blacklist = blacklist
+    self.pool = None
+    self.mapped = None
+    self.index = 0 # position in the MasterXlogReader's list of xlogs
 
   def reinit(self, cursor):
     """Reinitialize for a further read from this file."""
@@ -226,12 +268,11 @@ class Xlogfile:
     # them from the remote server, so we should not read past the point
     # in the local file corresponding to the point where we pulled from the
     # remote server.
+    # Remote files have already been fetched by MasterXlogReader.reinit.
     self.xlog.prepare()
     if self.local:
       self.size = os.path.getsize(self.xlog.local_path)
     else:
-      if not OPT.no_download:
-        self.fetch_remote()
       # TODO: why does the local size check not just use self.filename?
       # set this in _open?
       try:
@@ -240,16 +281,8 @@ class Xlogfile:
         self.size = 0
     if self.have_handle() and self.offset is None:
       self.init_offset_from_db(cursor)
-
-  def fetch_remote(self):
-    if self.xlog.dormant:
-      info("Skipping dormant remote logfile at %s" % self.url)
-    else:
-      info("Fetching remote %s to %s with wget -c" % (self.url, self.filename))
-    try:
-      self.xlog.fetch()
-    except IOError as e:
-      warn("Could not fetch %s: %s" % (self.url, e))
+    # Remap on the next read, up to the new size snapshot.
+    self.mapped = None
 
   def _open(self):
     try:
@@ -276,6 +309,12 @@ class Xlogfile:
     if not self.have_handle():
       return
 
+    if self.pool is not None:
+      return self._parallel_line()
+
+    if OPT.mmap:
+      return self._mapped_line(cursor)
+
     while True:
       if self.offset is None:
         self.init_offset_from_db(cursor)
@@ -300,26 +339,154 @@ class Xlogfile:
 
       # If this is a blank line or a broken xlogline, advance the offset
       # and keep reading.
-      if not line.strip() or invalid_xlog_line(line.strip()):
-        if line.strip():
-          warn("Skipping invalid line in %s: %s" % (self.filename, line))
+      xdict = xlog_record(line, self.filename)
+      if xdict is None:
         continue
 
-      try:
-        d = xlog_dict(line, self.filename)
-        xdict = apply_dbtypes(d)
-      except:
-        info("Bad line: " + line + " in " + self.filename)
-        continue
+      return self._xlogline(line_start, xdict)
 
-      # n.b. the db update of logfile_offsets is triggered by creating this
-      # object, and the stored offset there is the beginning of this line. That
-      # way, we always return to a known good line in the logfile. On a daemon
-      # restart, the first line is skipped.
-      xline = Xlogline( self, self.filename, line_start,
-                        xdict.get('end') or xdict.get('time'),
-                        xdict, self.proc_op )
-      return xline
+  def _mapped_line(self, cursor):
+    if self.offset is None:
+      self.init_offset_from_db(cursor)
+    if self.mapped is None:
+      # Remote files are only read up to the size after the last fetch too;
+      # anything past it may be a partial write from wget.
+      self.mapped = xlog.reader.mapped_lines(self.filename, self.offset,
+                                             self.size or 0)
+    for line_start, line_end, line in self.mapped:
+      self.offset = line_end
+      xdict = xlog_record(line, self.filename)
+      if xdict is not None:
+        return self._xlogline(line_start, xdict)
+    # Leave the handle at the next unread line in case serial reads resume.
+    self.handle.seek(self.offset)
+    return None
+
+  def _xlogline(self, line_start, xdict):
+    # n.b. the db update of logfile_offsets is triggered by creating this
+    # object, and the stored offset there is the beginning of this line. That
+    # way, we always return to a known good line in the logfile. On a daemon
+    # restart, the first line is skipped.
+    return Xlogline( self, self.filename, line_start,
+                     xdict.get('end') or xdict.get('time'),
+                     xdict, self.proc_op )
+
+  def start_parallel_parse(self, pool):
+    """Hand the unread part of this file (up to the size snapshot taken in
+    reinit) to a worker pool. Until stop_parallel_parse is called, `line`
+    returns records parsed by the pool instead of reading the file itself."""
+    if not self.have_handle() or self.offset is None or self.size is None:
+      return
+    self.pool = pool
+    self.parse_ranges = xlog_ranges(self.filename, self.offset, self.size,
+                                    PARSE_CHUNK_SIZE)
+    self.parse_results = deque()
+    self.parsed = deque()
+    self.parsed_end = None
+    self._queue_parse_ranges()
+
+  def _queue_parse_ranges(self):
+    while self.parse_ranges and len(self.parse_results) < PARSE_AHEAD:
+      try:
+        start, end = self.parse_ranges.next()
+      except StopIteration:
+        self.parse_ranges = None
+        break
+      self.parse_results.append(
+          self.pool.apply_async(parse_xlog_range, (self.filename, start, end)))
+
+  def stop_parallel_parse(self):
+    """Stop using the worker pool for this file. Anything parsed but not yet
+    returned by `line` is discarded, and the file handle is repositioned to
+    the next unreturned line so that serial reads continue from there."""
+    if self.pool is None:
+      return
+    self.pool = None
+    self.parse_ranges = None
+    self.parse_results = None
+    self.parsed = None
+    if self.handle and self.offset is not None:
+      self.handle.seek(self.offset)
+
+  def _parallel_line(self):
+    while True:
+      if self.parsed:
+        line_start, line_end, xdict = self.parsed.popleft()
+        self.offset = line_end
+        return self._xlogline(line_start, xdict)
+      # Everything from the last range has been returned; this also skips
+      # past any blank or invalid lines at the end of that range.
+      if self.parsed_end is not None:
+        self.offset = self.parsed_end
+        self.parsed_end = None
+      if not self.parse_results:
+        return None
+      records, self.parsed_end = self.parse_results.popleft().get()
+      self.parsed.extend(records)
+      self._queue_parse_ranges()
+
+def xlog_record(line, filename):
+  """Parses a single raw line from the given xlogfile into an XlogGame.
+  Returns None for blank and broken lines, which should be skipped."""
+  if not line.strip() or invalid_xlog_line(line.strip()):
+    if line.strip():
+      warn("Skipping invalid line in %s: %s" % (filename, line))
+    return None
+  try:
+    return XlogGame.from_xdict(xlog_dict(line, filename))
+  except:
+    info("Bad line: " + line + " in " + filename)
+    return None
+
+def xlog_ranges(filename, start, end, chunk_size):
+  """Splits the byte range [start, end) of an xlogfile into consecutive
+  ranges of roughly chunk_size bytes, each ending just after a newline (except
+  possibly the last, which ends at `end`). Yields (start, end) pairs."""
+  f = open(filename)
+  try:
+    while start < end:
+      split = start + chunk_size
+      if split < end:
+        f.seek(split)
+        f.readline()
+        split = f.tell()
+      split = min(split, end)
+      yield (start, split)
+      start = split
+  finally:
+    f.close()
+
+def parse_xlog_range(filename, start, end):
+  """Parses the complete lines in the byte range [start, end) of an xlogfile.
+  Returns a list of (line start, line end, XlogGame) tuples, skipping
+  blank and broken lines, along with the offset just past the last complete
+  line in the range. This is run in parse worker processes."""
+  f = open(filename)
+  try:
+    f.seek(start)
+    data = f.read(end - start)
+  finally:
+    f.close()
+  records = []
+  pos = 0
+  while True:
+    nl = data.find("\n", pos)
+    if nl == -1:
+      break
+    line = data[pos:nl + 1]
+    line_start = start + pos
+    pos = nl + 1
+    xdict = xlog_record(line, filename)
+    if xdict is not None:
+      records.append((line_start, start + pos, xdict))
+  return records, start + pos
+
+def init_parse_worker():
+  # Shutdown and ctrl-c are handled by the main process, which will terminate
+  # the pool.
+  signal.signal(signal.SIGTERM, signal.SIG_DFL)
+  signal.signal(signal.SIGHUP, signal.SIG_DFL)
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
 
 class Logfile (Xlogfile):
   def __init__(self, xlog_def):
@@ -335,8 +502,24 @@ class MasterXlogReader:
   processed in chronological order."""
   def __init__(self, xlogs):
     self.xlogs = xlogs
+    for i, x in enumerate(xlogs):
+      x.index = i
+    self.merging = 0
+    self.batcher = CommitBatcher()
+    self.fetcher = xlog.fetch.Fetcher(FETCH_WORKERS, FETCH_TIMEOUT,
+                                      FETCH_STATE_FILE, FETCH_IDLE_POLLS,
+                                      FETCH_MAX_IDLE_WAIT)
+
+  def fetch_remote(self):
+    """Fetch all the remote logfiles, in parallel."""
+    for x in self.xlogs:
+      if not x.local and x.xlog.dormant:
+        debug("Skipping dormant remote logfile at %s" % x.url)
+    self.fetcher.fetch([x.xlog for x in self.xlogs])
 
   def reinit(self, cursor):
+    if not OPT.no_download:
+      self.fetch_remote()
     for x in self.xlogs:
       x.reinit(cursor)
 
@@ -367,64 +550,260 @@ class MasterXlogReader:
     # do this before collecting lines, because that will change the offset.
     tail_start_remaining = self.remaining_size()
     tail_start_time = datetime.datetime.now()
+    stats.player_recent_cache.expect_load(tail_start_remaining)
+
+    bulkload.check_indexes(cursor, OPT.bulk_load)
+    # only the first load into an empty db is a bulk load.
+    if OPT.bulk_load and stats.player_recent_cache.most_recent_start is None:
+      stats.player_recent_cache.init_most_recent_from_db(cursor)
+      if stats.player_recent_cache.most_recent_start is None:
+        bulkload.begin(cursor)
 
-    lines = [ line for line in [ x.line(cursor) for x in self.xlogs ]
-              if line ]
+    pool = self.start_parse_pool()
+    try:
+      self._tail_all(cursor, stats, tail_start_remaining, tail_start_time)
+    finally:
+      self.stop_parse_pool(pool)
+    bulkload.end(cursor)
+
+  def start_parse_pool(self):
+    if OPT.parse_workers < 1:
+      return None
+    info("Parsing logfiles with %d worker processes." % OPT.parse_workers)
+    pool = multiprocessing.Pool(OPT.parse_workers, init_parse_worker)
+    for x in self.xlogs:
+      x.start_parallel_parse(pool)
+    return pool
 
-    lines.sort()
+  def stop_parse_pool(self, pool):
+    if pool is None:
+      return
+    for x in self.xlogs:
+      x.stop_parallel_parse()
+    pool.terminate()
+    pool.join()
+
+  def merged_lines(self, cursor):
+    """Returns a generator over the unread lines of all the xlogs, oldest
+    first (see Xlogline.sort_key). The first line of each xlog is read
+    immediately; after that, `self.merging` is the number of xlogs that still
+    have lines in the merge."""
+    heap = [ (line.sort_key, line) for line in
+             [ x.line(cursor) for x in self.xlogs ] if line ]
+    heapq.heapify(heap)
+    self.merging = len(heap)
+    return self._merge(cursor, heap)
+
+  def _merge(self, cursor, heap):
+    while heap:
+      oldest = heap[0][1]
+      # Grab a replacement for the one we're going to return from the same
+      # file:
+      newline = oldest.owner.line(cursor)
+      if newline:
+        heapq.heapreplace(heap, (newline.sort_key, newline))
+      else:
+        heapq.heappop(heap)
+        self.merging = len(heap)
+      yield oldest
+
+  def _tail_all(self, cursor, stats, tail_start_remaining, tail_start_time):
+    lines = self.merged_lines(cursor)
     # would be nice to show lines, but it's a lot easier to get bytes without
     # going through the entire logfile in the first place.
     info("Got lines from %d logfiles, %s to process."
-                    % (len(lines), fmt_byte_size(tail_start_remaining, 3)))
+                    % (self.merging, fmt_byte_size(tail_start_remaining, 3)))
+    if OPT.pipeline:
+      if config.USE_MILESTONES:
+        # milestone processing still writes to the db as it goes, which has to
+        # happen in the same transaction as the batch's flush.
+        warn("Milestones are enabled; not pipelining db flushes.")
+      else:
+        return self._tail_all_pipelined(cursor, stats, lines,
+                                        tail_start_remaining, tail_start_time)
     proc = 0
-    while lines:
-      # `lines` is sorted in descending order - pick the oldest.
-      oldest = lines.pop()
-      # Grab a replacement for the one we're going to read from the same file:
-      newline = oldest.owner.line(cursor)
-      if newline:
-        # insert this in the correct place in the sorted list
-        bisect.insort(lines, newline)
-
+    batch = 0
+    batch_start = time.time()
+    for oldest in lines:
       # And process the line
       oldest.process(cursor)
       proc += 1
+      batch += 1
       if LIMIT_ROWS > 0 and proc >= LIMIT_ROWS:
         break
-      if proc % COMMIT_INTERVAL == 0:
+      if batch >= self.batcher.size:
         # Do any periodict db work that has been saved up for batch commit.
         # calling this directly breaks the abstraction, but let's be honest,
         # the abstraction going on to get to act_on_logfile_line is out of
         # control.
+        flush_start = time.time()
         stats.periodic_flush(cursor)
         logfile_offset_cache.insert(cursor)
 
         cursor.db.commit()
-        seconds_passed = int(
-                  (datetime.datetime.now() - tail_start_time).total_seconds())
-        if seconds_passed == 0:
-          continue
-        interim_remaining = self.remaining_size()
-        # int here is for future py3 compatibility
-        rate = int((tail_start_remaining - interim_remaining) / seconds_passed)
-        line_rate = int(proc / seconds_passed)
-        remaining_time = (rate
-              and str(datetime.timedelta(seconds=int(interim_remaining / rate)))
-              or "inf")
-        info("Processed %d lines; %s from %d logfiles remaining. %d lines/s (%s/s), ETA %s"
-                        % (proc, fmt_byte_size(interim_remaining), len(lines),
-                           line_rate, fmt_byte_size(rate), remaining_time))
+        now = time.time()
+        self.batcher.batch_done(batch, flush_start - batch_start,
+                                now - flush_start, self.remaining_size())
+        batch = 0
+        batch_start = now
+        self.log_progress(proc, tail_start_remaining, tail_start_time)
     if proc > 0:
       stats.periodic_flush(cursor)
       logfile_offset_cache.insert(cursor)
       cursor.db.commit()
-      seconds_passed = int(
-                  (datetime.datetime.now() - tail_start_time).total_seconds())
-      td_total = datetime.timedelta(seconds=seconds_passed)
-      line_rate = seconds_passed and str(int(proc / seconds_passed)) or "inf"
-      info("Done processing %s from %d lines; %s lines/s in %s."
-                        % (fmt_byte_size(tail_start_remaining, 3),
-                           proc, line_rate, str(td_total)))
+      self.log_done(proc, tail_start_remaining, tail_start_time)
+
+  def _tail_all_pipelined(self, cursor, stats, lines, tail_start_remaining,
+                          tail_start_time):
+    # Lines are read and parsed a batch at a time while the previous batch is
+    # flushed and committed by a BatchFlusher. Processing a batch (which
+    # fills the stats caches, reading from the db as it goes) only starts
+    # once the previous flush is committed, so there is never more than one
+    # batch in flight, and each commit holds exactly one batch along with its
+    # logfile offsets.
+    flusher = BatchFlusher(stats)
+    try:
+      proc = 0
+      last_batch = 0
+      process_time = 0
+      while True:
+        # n.b. this size is picked before the previous flush has finished, so
+        # the batcher's decisions lag by a batch here.
+        n = self.batcher.size
+        if LIMIT_ROWS > 0:
+          n = min(n, LIMIT_ROWS - proc)
+        batch = list(itertools.islice(lines, n))
+        flusher.wait()
+        if last_batch:
+          self.batcher.batch_done(last_batch, process_time,
+                                  flusher.flush_time, self.remaining_size())
+          self.log_progress(proc, tail_start_remaining, tail_start_time)
+        if not batch:
+          break
+        # start a new transaction, so that reads see the last flush.
+        cursor.db.commit()
+        process_start = time.time()
+        for oldest in batch:
+          oldest.process(cursor)
+        process_time = time.time() - process_start
+        proc += len(batch)
+        last_batch = len(batch)
+        flusher.start()
+      if proc > 0:
+        cursor.db.commit()
+        self.log_done(proc, tail_start_remaining, tail_start_time)
+    finally:
+      flusher.close()
+
+  def log_progress(self, proc, tail_start_remaining, tail_start_time):
+    seconds_passed = int(
+              (datetime.datetime.now() - tail_start_time).total_seconds())
+    if seconds_passed == 0:
+      return
+    interim_remaining = self.remaining_size()
+    # int here is for future py3 compatibility
+    rate = int((tail_start_remaining - interim_remaining) / seconds_passed)
+    line_rate = int(proc / seconds_passed)
+    remaining_time = (rate
+          and str(datetime.timedelta(seconds=int(interim_remaining / rate)))
+          or "inf")
+    info("Processed %d lines; %s from %d logfiles remaining. %d lines/s (%s/s), ETA %s; %s"
+                    % (proc, fmt_byte_size(interim_remaining), self.merging,
+                       line_rate, fmt_byte_size(rate), remaining_time,
+                       self.batcher.describe()))
+
+  def log_done(self, proc, tail_start_remaining, tail_start_time):
+    seconds_passed = int(
+                (datetime.datetime.now() - tail_start_time).total_seconds())
+    td_total = datetime.timedelta(seconds=seconds_passed)
+    line_rate = seconds_passed and str(int(proc / seconds_passed)) or "inf"
+    info("Done processing %s from %d lines; %s lines/s in %s."
+                      % (fmt_byte_size(tail_start_remaining, 3),
+                         proc, line_rate, str(td_total)))
+
+class CommitBatcher(object):
+  """Picks how many lines to process between commits. The cost per line of
+  a batch (processing plus flush) is tracked as a moving average, and the
+  batch size is set so that a batch takes about the target latency: the bulk
+  target while a lot of logfile remains to be read, otherwise the normal one.
+  The size changes by at most a factor of two per batch."""
+  def __init__(self, size=COMMIT_INTERVAL):
+    self.size = size
+    self.line_cost = None
+    self.flush_time = 0
+    self.target = COMMIT_LATENCY
+
+  def batch_done(self, lines, process_time, flush_time, remaining):
+    """Record the timing of a committed batch, and resize the next one."""
+    if lines <= 0:
+      return
+    cost = (process_time + flush_time) / lines
+    if self.line_cost is None:
+      self.line_cost = cost
+    else:
+      self.line_cost = 0.7 * self.line_cost + 0.3 * cost
+    self.flush_time = flush_time
+    if remaining > BULK_REMAINING:
+      self.target = BULK_COMMIT_LATENCY
+    else:
+      self.target = COMMIT_LATENCY
+    if self.line_cost > 0:
+      size = int(self.target / self.line_cost)
+    else:
+      size = MAX_COMMIT_INTERVAL
+    size = max(self.size // 2, min(self.size * 2, size))
+    self.size = max(MIN_COMMIT_INTERVAL, min(MAX_COMMIT_INTERVAL, size))
+
+  def describe(self):
+    return ("batches of %d lines (last flush %.2fs, target %ss)"
+            % (self.size, self.flush_time, self.target))
+
+class BatchFlusher(object):
+  """Flushes the stats caches and logfile offsets for a batch of lines, and
+  commits, on a separate thread with its own db connection."""
+  def __init__(self, stats):
+    self.stats = stats
+    self.db = connect_db(password=OPT.mysql_pass, host=OPT.mysql_host)
+    self.cursor = self.db.cursor()
+    self.cursor.db = self.db
+    self.thread = None
+    self.exc_info = None
+    self.flush_time = 0
+
+  def start(self):
+    """Start flushing everything processed so far. Nothing may touch the
+    caches until `wait` returns."""
+    self.wait()
+    self.thread = threading.Thread(target=self._flush,
+                                   name="BatchFlusher")
+    self.thread.start()
+
+  def _flush(self):
+    flush_start = time.time()
+    try:
+      self.stats.periodic_flush(self.cursor)
+      logfile_offset_cache.insert(self.cursor)
+      self.db.commit()
+      self.flush_time = time.time() - flush_start
+    except:
+      self.exc_info = sys.exc_info()
+
+  def wait(self):
+    """Wait for the flush in progress, if any, and raise any error from it."""
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+    if self.exc_info is not None:
+      exc_info = self.exc_info
+      self.exc_info = None
+      raise exc_info[0], exc_info[1], exc_info[2]
+
+  def close(self):
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+    self.cursor.close()
+    self.db.close()
 
 def connect_db(password=None, host=None):
   if host is None:
@@ -436,6 +815,8 @@ def connect_db(password=None, host=None):
   }
   if password is not None:
     opts['password'] = password
+  if OPT.bulk_load:
+    opts['local_infile'] = True
   connection = MySQLdb.connect(**opts)
   return connection
 
@@ -444,12 +825,9 @@ def parse_logline(logline):
   and parses it into a dictionary (which everyone except Python calls a hash).
   Because the Crawl developers are insane, a double-colon is an escaped colon,
   and so we have to be careful not to split the logfile on locations like
-  D:7 and such. It also works on milestones and whereis."""
-  # This is taken from Henzell. Yay Henzell!
-  logline = logline.replace("::", "\n")
-  return dict([(item[:item.index('=')],
-                item[item.index('=') + 1:].replace("\n", ":"))
-               for item in logline.split(':')])
+  D:7 and such. It also works on milestones and whereis. See xlog.parser for
+  the details."""
+  return xlog.parser.parse_xlog(logline)
 
 def xlog_set_killer_group(d):
   killer = d.get('killer')
@@ -530,7 +908,7 @@ def canonical_killer(g):
 def invalid_xlog_line(logline):
   logline = logline.strip()
   # Reject anything with less than 6 fields
-  return logline.count(':') < 5 # TODO: this test is messed up by escaped ::
+  return xlog.parser.field_count(logline) < 6
 
 def xlog_dict(logline, source_file=None):
   d = parse_logline(logline.strip())
@@ -871,6 +1249,28 @@ LOGF_SQLTYPE = dict([ (x, dbfield_to_sqltype[COMBINED_LOG_TO_DB[x]])
                            in [crawl_datetime, sql_int, bigint]) ])
 LOGF_SQLKEYS = LOGF_SQLTYPE.keys()
 
+# Games and milestones are carried through the loader as compact XlogGame
+# records (see xlog.record) with one slot per db column, rather than as dicts.
+# Logfile field names that differ from the db names ('char', 'start', ...)
+# are aliases for the db fields, and values are converted to their db types
+# once, when the record is built. Logfile fields without a db column are
+# dropped, except for these:
+XLOG_RECORD_EXTRA_FIELDS = [ 'type' ]
+
+def _xlog_record_fields():
+  fields = [ ]
+  for f in (LOG_DB_COLUMNS + [x[1] for x in MILE_DB_MAPPINGS]
+            + XLOG_RECORD_EXTRA_FIELDS):
+    if f not in fields:
+      fields.append(f)
+  return fields
+
+XlogGame = xlog.record.record_class(
+  'XlogGame', _xlog_record_fields(),
+  aliases = dict([(x, COMBINED_LOG_TO_DB[x]) for x in DB_COPY_FIELDS]),
+  conversions = LOGF_SQLTYPE,
+  module = __name__)
+
 def is_selected(game):
   """Accept all games that match our version criterion."""
   return ('v' in game and game['v'] >= OLDEST_VERSION
@@ -1178,6 +1578,10 @@ def scload():
     print("Requesting daemon stop: this may take some time.")
     crawl_utils.write_scoresd_stop_request()
     return
+  if OPT.warm_templates:
+    import pagedefs
+    pagedefs.warm_templates()
+    return
 
   crawl_utils.lock_or_die()
   print "Populating db (one-off) with logfiles and milestones. " + \
@@ -1207,9 +1611,11 @@ def scload():
     import pagedefs
     # OPT.no_load is checked in this call
     pagedefs.incremental_build(cursor) # trigger first_run processing
+    pagedefs.wait_for_renders()
   finally:
     set_active_cursor(None)
     cursor.close()
 
   report_query_times()
+  report_memoizer_stats()
   db.close()
@@ -14,6 +14,7 @@ import logging
 from logging import debug, info, warn, error
 
 import pagedefs
+import snapshot
 
 def signal_handler(signum, frame):
   info("Received signal %i, terminating!", signum)
@@ -56,6 +57,7 @@ def tail_logfiles(logs, milestones, interval=60):
   master = scload.create_master_reader()
   scload.bootstrap_known_raceclasses(cursor)
   scload.init_game_restrictions(cursor)
+  snapshot.load(cursor)
 
   daemon_loop = True
 
@@ -64,10 +66,15 @@ def tail_logfiles(logs, milestones, interval=60):
     pagedefs.incremental_build(cursor)
     daemon_loop = False # a one-off command, don't really start the daemon
 
+  # whether the stats caches match what has been committed, so that they can
+  # be snapshotted on the way out.
+  committed = False
   try:
     while daemon_loop:
+      committed = False
       try:
         interval_work(cursor, interval, master)
+        committed = True
         pagedefs.incremental_build(cursor)
         if not interval:
           break
@@ -83,8 +90,6 @@ def tail_logfiles(logs, milestones, interval=60):
       time.sleep(interval)
       elapsed_time += interval
 
-      pagedefs.tick_dirty()
-
       if check_daemon_stop():
         break
   except KeyboardInterrupt: # signal or ctrl-c in non-daemon mode
@@ -97,6 +102,11 @@ def tail_logfiles(logs, milestones, interval=60):
         pagedefs.flush_pages(cursor) # flush any dirty player pages
       except Exception as e:
         error("Failed to flush pages: " + str(e))
+    if committed:
+      try:
+        snapshot.save(cursor)
+      except Exception as e:
+        error("Failed to save snapshot: " + str(e))
     scload.set_active_cursor(None)
     cursor.close()
     db.close()
@@ -120,6 +130,10 @@ if __name__ == '__main__':
   if scload.OPT.stop_daemon:
     stop_daemon(scload.OPT.stop_daemon_wait) # NORETURN
 
+  if scload.OPT.warm_templates:
+    pagedefs.warm_templates()
+    sys.exit(0)
+
   crawl_utils.clear_scoresd_stop_request() # just in case
 
   if daemon:
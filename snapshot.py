@@ -0,0 +1,111 @@
+# Warm-start snapshot of the loader's in-memory state. When the daemon shuts
+# down cleanly, the state that the stats caches would otherwise have to query
+# back from the db (memoized per-player counts and leaderboard floors, the
+# active streak ids, the top games heap, the most recent game start, and the
+# game key filter) is pickled to SNAPSHOT_FILE (the key filter goes in
+# KEY_FILTER_FILE) along with the logfile offsets in the db. The next
+# daemon start loads it, but only if the offsets still match, i.e. nothing has
+# been loaded into the db since. A snapshot is only used once.
+
+import os
+import cPickle
+
+import bloom
+import config
+import stats
+import query
+from scload import query_rows
+
+from logging import debug, info, warn, error
+
+SNAPSHOT_VERSION = 2
+SNAPSHOT_FILE = os.path.join(config.LOCALBASE,
+                             '%s.snapshot' % config.SCORING_KEY)
+KEY_FILTER_FILE = SNAPSHOT_FILE + '.keys'
+
+MEMOIZERS = [ stats.player_best_game_count, stats.player_lowest_highscore,
+              stats.player_first_game_exists, stats.player_recent_game_count,
+              stats.player_streak_is_active, stats.all_recent_game_count,
+              stats.top_score_for_combo, stats.top_score_for_species,
+              stats.top_score_for_class, query.canonicalize_player_name ]
+
+def db_offsets(c):
+  return dict(query_rows(c, '''SELECT filename, offset FROM logfile_offsets'''))
+
+def save(c):
+  """Write the snapshot. Everything must have been flushed and committed."""
+  # end the current transaction, so that the offsets are the latest ones.
+  c.db.commit()
+  top = stats.top_games_cache
+  recent = stats.player_recent_cache
+  state = { 'version': SNAPSHOT_VERSION,
+            'offsets': db_offsets(c),
+            'memos': dict([(m.name, m.dump()) for m in MEMOIZERS]),
+            'streaks': stats.streaks_cache.db_streaks,
+            'top_games': top.heap is not None and
+                         (top.heap, top.seq, top.max_id, top.top) or None,
+            'recent': (recent.most_recent_start, recent.empty_db_start,
+                       recent.empty_db_gid_cache_l),
+            'key_filter': recent.key_filter is not None }
+  if recent.key_filter is not None:
+    recent.key_filter.save(KEY_FILTER_FILE)
+  tmp = "%s.%d.tmp" % (SNAPSHOT_FILE, os.getpid())
+  try:
+    f = open(tmp, 'wb')
+    try:
+      cPickle.dump(state, f, 2)
+    finally:
+      f.close()
+    os.rename(tmp, SNAPSHOT_FILE)
+    info("Saved warm-start snapshot to %s" % SNAPSHOT_FILE)
+  finally:
+    if os.path.exists(tmp):
+      os.unlink(tmp)
+
+def discard():
+  for path in (SNAPSHOT_FILE, KEY_FILTER_FILE):
+    if os.path.exists(path):
+      os.unlink(path)
+
+def load(c):
+  """Restore the stats caches from the snapshot, if there is a usable one.
+  Returns whether it was used."""
+  if not os.path.exists(SNAPSHOT_FILE):
+    return False
+  try:
+    try:
+      f = open(SNAPSHOT_FILE, 'rb')
+      try:
+        state = cPickle.load(f)
+      finally:
+        f.close()
+      key_filter = None
+      if state.get('key_filter'):
+        key_filter = bloom.BloomFilter.load(KEY_FILTER_FILE)[0]
+    except Exception, e:
+      warn("Ignoring unreadable snapshot %s: %s" % (SNAPSHOT_FILE, e))
+      return False
+  finally:
+    discard()
+  if state.get('version') != SNAPSHOT_VERSION:
+    info("Ignoring snapshot from a different version.")
+    return False
+  if state['offsets'] != db_offsets(c):
+    info("Ignoring snapshot: the db has changed since it was written.")
+    return False
+
+  for m in MEMOIZERS:
+    if m.name in state['memos']:
+      m.load(state['memos'][m.name])
+  stats.streaks_cache.db_streaks = state['streaks']
+  if state['top_games'] is not None:
+    top = stats.top_games_cache
+    top.heap, top.seq, top.max_id, top.top = state['top_games']
+  recent = stats.player_recent_cache
+  (recent.most_recent_start, recent.empty_db_start,
+   recent.empty_db_gid_cache_l) = state['recent']
+  recent.empty_db_gid_cache = set(recent.empty_db_gid_cache_l)
+  if key_filter is not None and not key_filter.full():
+    recent.key_filter = key_filter
+  info("Loaded warm-start snapshot from %s" % SNAPSHOT_FILE)
+  return True
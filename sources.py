@@ -113,7 +113,8 @@ class Source (object):
         files.append(factory(path, source_name=self.name,
                              base_url=self.base, local_base=self.local,
                              dormant=self.dormant,
-                             xlog_type=file_type))
+                             xlog_type=file_type,
+                             fetch_timeout=self.get_cfg('fetch_timeout')))
     return files
 
   def _resolve_morgue_bases(self, key):
@@ -6,17 +6,20 @@ except ImportError:
 
 import scload
 import query
+import bulkload
+import bloom
 
+import bisect
+import heapq
 import logging
 from logging import debug, info, warn, error
 import crawl_utils
-from memoizer import DBMemoizer
+from memoizer import DBMemoizer, PLAYER_CACHE_SIZE
 import crawl
 
 from scload import query_do, query_first, query_first_col, wrap_transaction
 from scload import query_first_def, game_is_win, query_row, query_rows
-from query import count_players_per_day, winners_for_day
-from pagedefs import dirty_page, dirty_player, dirty_pages
+from pagedefs import dirty_player, note_change
 
 TOP_N = 1000
 MAX_PLAYER_BEST_GAMES = 15
@@ -24,6 +27,10 @@ MAX_PLAYER_RECENT_GAMES = 15
 MAX_ALL_RECENT_GAMES = 100
 MAX_LOW_XL_RUNE_FINDS = 10
 MAX_ZIGGURAT_VISITS = 10
+# The number of top games shown on the overview page.
+TOP_GAMES_SHOWN = 5
+# A game scoring this much is a notable change to the player leaderboards.
+NOTABLE_SCORE = 40000
 
 # So there are a few problems we have to solve:
 # 1. Intercepting new logfile events
@@ -73,7 +80,7 @@ def add_rune_milestone(c, g):
                                                rune_time, rune, xl)
                      VALUES (%s, %s, %s, %s, %s)''',
              g['name'], g['start'], g['time'], rune, xl)
-    dirty_page('overview')
+    note_change('low_xl_rune_finds')
 
   if low_xl_rune_count(c) >= MAX_LOW_XL_RUNE_FINDS:
     worst_rune = worst_xl_rune_find(c)
@@ -128,7 +135,7 @@ def add_ziggurat_milestone(c, g):
                                VALUES (%s, %s, %s, %s, %s)''',
              player, depth, place, g['time'], g['start'])
     player_ziggurat_deepest.flush_key(player)
-    dirty_page('overview', 1)
+    note_change('ziggurats')
 
   if deepest:
     if depth >= deepest:
@@ -137,7 +144,7 @@ def add_ziggurat_milestone(c, g):
                                        zig_time = %s, start_time = %s
                                  WHERE player = %s''',
                depth, place, g['time'], g['start'], player)
-      dirty_page('overview', 1)
+      note_change('ziggurats')
   else:
     if ziggurat_entry_count(c) >= MAX_ZIGGURAT_VISITS:
       row = ziggurat_row_inferior_to(c, depth)
@@ -153,14 +160,6 @@ def act_on_milestone(c, g):
   add_rune_milestone(c, g)
   add_ziggurat_milestone(c, g)
 
-@DBMemoizer
-def topN_count(c):
-  return query_first(c, '''SELECT COUNT(*) FROM top_games''')
-
-@DBMemoizer
-def lowest_highscore(c):
-  return query_first(c, '''SELECT MIN(sc) FROM top_games''')
-
 # don't add player_recent_games to this list, or duplicate detection won't work
 # right
 NO_BUGGY_GAMES = {'streak_games', 'streak_breakers', 'wins', 'top_games', 'top_combo_scores',
@@ -201,7 +200,15 @@ def insert_games(c, g_list, table):
   colnames = scload.LOG_DB_SCOLUMNS
   places = scload.LOG_DB_SPLACEHOLDERS
 
-  # TODO: handle NO_BUGGY_GAMES?
+  if table in NO_BUGGY_GAMES:
+    g_list = [g for g in g_list if not game_is_buggy(g)]
+  if not g_list:
+    return True
+  note_change(table)
+  if bulkload.active():
+    bulkload.load_rows(c, table, colnames,
+                       [[g.get(x[0]) for x in cols] for g in g_list])
+    return True
   try:
     c.executemany(
            'INSERT IGNORE INTO %s (%s) VALUES (%s)' % (table, colnames, places),
@@ -212,46 +219,25 @@ def insert_games(c, g_list, table):
     error("Failing query: " + c._last_executed)
     raise
 
-# TODO: does TOP_N really need to be 1000? does anyone ever even look at that
-# leaderboard?
-# However, this is really only heavy towards the beginning of loading data
-# during a bulk import, so there may not be a need to optimize it further.
-def update_topN(c, g, n):
-  if topN_count(c) >= n:
-    if g['sc'] > lowest_highscore(c):
-      # note: for some reason this particular query is faster than just a simple
-      # DELETE FROM ... ORDER BY query.
-      query_do(c,'''DELETE FROM top_games
-                          WHERE id = %s''',
-               query_first(c, '''SELECT id FROM top_games
-                                  ORDER BY sc LIMIT 1'''))
-      insert_game(c, g, 'top_games')
-      lowest_highscore.flush()
-      dirty_pages('top-N', 'overview')
-  else:
-    insert_game(c, g, 'top_games')
-    dirty_pages('top-N', 'overview')
-    topN_count.flush()
-
-@DBMemoizer
+@DBMemoizer.sized(PLAYER_CACHE_SIZE)
 def player_best_game_count(c, player):
   return query_first(c, '''SELECT COUNT(*) FROM player_best_games
                                           WHERE name = %s''',
                      player)
 
-@DBMemoizer
+@DBMemoizer.sized(PLAYER_CACHE_SIZE)
 def player_lowest_highscore(c, player):
   return query_first(c, '''SELECT MIN(sc) FROM player_best_games
                                          WHERE name = %s''',
                      player)
 
-@DBMemoizer
+@DBMemoizer.sized(PLAYER_CACHE_SIZE)
 def player_first_game_exists(c, player):
   return query_first_def(c, False,
                          '''SELECT id FROM player_first_games
                                 WHERE name = %s''', player)
 
-@DBMemoizer
+@DBMemoizer.sized(PLAYER_CACHE_SIZE)
 def player_recent_game_count(c, player):
   return query_first(c, '''SELECT COUNT(*) FROM player_recent_games
                                           WHERE name = %s''',
@@ -261,7 +247,7 @@ def player_recent_game_count(c, player):
 def all_recent_game_count(c):
   return query_first(c, '''SELECT COUNT(*) FROM all_recent_games''')
 
-@DBMemoizer
+@DBMemoizer.sized(PLAYER_CACHE_SIZE)
 def player_streak_is_active(c, player):
   return query_first_def(c, False,
                          '''SELECT active FROM streaks
@@ -301,15 +287,10 @@ def game_key_in_db(c, g):
                                         WHERE game_key = %s''', g['game_key'])
   return n > 0
 
-def update_player_first_game(c, g):
-  player = g['name']
-  if not player_first_game_exists(c, player):
-    player_first_game_exists.flush_key(player)
-    insert_game(c, g, 'player_first_games')
-
 def update_player_stats(c, g):
   global player_stats_cache, all_recent_games_cache, streaks_cache
   global player_recent_cache, player_best_cache, wins_cache
+  global player_first_cache
   winc = game_is_win(g) and 1 or 0
 
   if player_recent_cache.game_key_exists(c, g):
@@ -320,17 +301,9 @@ def update_player_stats(c, g):
   player_recent_cache.update(g)
 
   if winc:
-    dirty_page('best-players-total-score')
-    dirty_page('all-players')
-    dirty_player(g['name'])
+    dirty_player(g['name'], 0)
   else:
-    if g['sc'] > 0:
-      factor = int(g['sc'] / 40000) + 1
-      dirty_page('best-players-total-score', factor)
-      dirty_page('all-players', factor)
-      dirty_player(g['name'], factor)
-    else:
-      dirty_player(g['name'], 1)
+    dirty_player(g['name'])
 
   player_stats_cache.update(g)
 
@@ -340,14 +313,14 @@ def update_player_stats(c, g):
   player_best_cache.update(g)
   all_recent_games_cache.update(g)
   wins_cache.update(g)
-  update_player_first_game(c, g)
+  player_first_cache.update(c, g)
   return True
 
 def top_score_for_cthing(c, col, table, thing):
   q = "SELECT sc FROM %s WHERE %s = %s" % (table, col, '%s')
   return query_first_def(c, 0, q, thing)
 
-@DBMemoizer
+@DBMemoizer.sized(5000)
 def top_score_for_combo(c, ch):
   return top_score_for_cthing(c, 'charabbr', 'top_combo_scores', ch)
 
@@ -359,35 +332,6 @@ def top_score_for_species(c, sp):
 def top_score_for_class(c, cls):
   return top_score_for_cthing(c, 'cls', 'top_class_scores', cls)
 
-def update_topscore_table_for(c, g, fn, table, thing):
-  sc = g['sc']
-  value = g[thing]
-  if sc > fn(c, value):
-    fn.set_key(sc, value)
-    query_do(c, "DELETE FROM " + table + " WHERE " + thing + " = %s", value)
-    insert_game(c, g, table)
-    dirty_page('top-combo-scores', 25)
-    dirty_page('combo-scoreboard', 25)
-    dirty_page('overview', 5)
-
-def update_combo_scores(c, g):
-  update_topscore_table_for(c, g, top_score_for_combo,
-                            'top_combo_scores', 'charabbr')
-  update_topscore_table_for(c, g, top_score_for_species,
-                            'top_species_scores', 'raceabbr')
-  update_topscore_table_for(c, g, top_score_for_class,
-                            'top_class_scores', 'cls')
-
-def update_gkills(c, g):
-  if scload.is_ghost_kill(g):
-    dirty_page('gkills', 1)
-    ghost = scload.extract_ghost_name(g['killer'])
-    if ghost != g['name']:
-      query_do(c,
-               '''INSERT INTO ghost_victims (ghost, victim) VALUES (%s, %s)''',
-               ghost, g['name'])
-
-
 def is_loser_ktyp(ktyp):
   """The moron games"""
   return ktyp in ['leaving', 'quitting']
@@ -428,14 +372,29 @@ class Wins(BulkDBCache):
   def update(self, g):
     if not game_is_win(g) or game_is_buggy(g):
       return
-    dirty_pages('winners', 'fastest-wins-turns', 'fastest-wins-time',
-            'overview')
     self.games.append(g)
 
   def insert(self, c):
     insert_games(c, self.games, 'wins')
     self.clear()
 
+class PlayerFirstGames(BulkDBCache):
+  def __init__(self):
+    self.clear()
+
+  def clear(self):
+    self.games = list()
+
+  def update(self, c, g):
+    player = g['name']
+    if not player_first_game_exists(c, player):
+      player_first_game_exists.set_key(True, player)
+      self.games.append(g)
+
+  def insert(self, c):
+    insert_games(c, self.games, 'player_first_games')
+    self.clear()
+
 class PlayerBestGames(BulkDBCache):
   def __init__(self):
     self.clear()
@@ -521,24 +480,40 @@ class PlayerBestGames(BulkDBCache):
 #      was written, but before the save was deleted. This should only be
 #      possible in old versions of dcss, and most of the cases I know of are
 #      handled by the heuristic cache size I have selected here.
-#      HOWEVER, if the player then takes a very long time to complete the
-#      game in a case like this, the optimized version of the game_key check
-#      will not catch it. If the heuristic misses a case, the game will still
-#      run up against the unique constraint on the two key tables (which is
-#      handled via INSERT IGNORE).
+#      If the player then takes a very long time to complete the game in a
+#      case like this, the gid cache won't have it, but it will be caught by
+#      the key filter below (as long as the first game is still in one of the
+#      two key tables). Otherwise, the game will still run up against the
+#      unique constraint on the two key tables (which is handled via INSERT
+#      IGNORE).
 #      (Side note: it's sort of unclear what to even do with these game
 #      records. Sequell allows duplicate game keys for this case...)
 #
 # The reason for this perhaps excessive-seeming optimization is that duplicate
 # checking is the heaviest remaining db access in the logline processing loop
 # without it.
+#
+# Past those checks, a Bloom filter of the game keys in the two key tables
+# (built from the db the first time it's needed, and then kept up to date as
+# games are flushed) answers most game_key checks without the db: only keys
+# that the filter may have seen are looked up. The filter is sized for the
+# games in the db plus an estimate of those in the logfiles still to be read,
+# and rebuilt at twice the size if it fills up anyway; past its capacity the
+# false positive rate climbs quickly.
 class PlayerRecentGames(BulkDBCache):
+  KEY_FILTER_MIN_CAPACITY = 1000000
+  KEY_FILTER_ERROR_RATE = 0.001
+  # on the low side for a logfile line, so that the estimate errs high.
+  KEY_FILTER_BYTES_PER_GAME = 400
+
   def __init__(self):
     self.most_recent_start = None # string in morgue start_time format
     self.empty_db_gid_cache = set()
     self.empty_db_gid_cache_l = list()
     self.EMPTY_DB_CACHE_SIZE = 1000
     self.empty_db_start = False
+    self.key_filter = None
+    self.expected_games = 0
     self.clear()
 
   def past_most_recent(self, g):
@@ -559,11 +534,40 @@ class PlayerRecentGames(BulkDBCache):
     else:
       self.most_recent_start = morgue.time.morgue_timestring(db_time)
 
+  def expect_load(self, remaining_bytes):
+    """Note how much logfile is left to read, for sizing the key filter."""
+    self.expected_games = remaining_bytes / self.KEY_FILTER_BYTES_PER_GAME
+
+  def init_key_filter(self, c, capacity=0):
+    """Build the filter of game keys from the tables that game_key_in_db
+    checks."""
+    tables = [ 'player_recent_games', 'wins' ]
+    n = sum([query_first(c, "SELECT COUNT(*) FROM " + t) for t in tables])
+    capacity = max(capacity, self.KEY_FILTER_MIN_CAPACITY,
+                   2 * (n + self.expected_games))
+    info("Building the game key filter from %d games (capacity %d)."
+         % (n, capacity))
+    self.key_filter = bloom.BloomFilter(capacity, self.KEY_FILTER_ERROR_RATE)
+    for t in tables:
+      last_id = 0
+      while True:
+        rows = query_rows(c, "SELECT id, game_key FROM " + t +
+                             " WHERE id > %s ORDER BY id LIMIT 100000",
+                          last_id)
+        if not rows:
+          break
+        for id, game_key in rows:
+          self.key_filter.add(game_key)
+        last_id = rows[-1][0]
+
   def _game_key_in_db_or_cache(self, c, g):
-    if self.empty_db_start:
-      return g['game_key'] in self.empty_db_gid_cache
-    else:
-      return game_key_in_db(c, g) # fall back to a SELECT query
+    if self.empty_db_start and g['game_key'] in self.empty_db_gid_cache:
+      return True
+    if self.key_filter is None:
+      self.init_key_filter(c)
+    if g['game_key'] not in self.key_filter:
+      return False
+    return game_key_in_db(c, g) # fall back to a SELECT query
 
   def game_key_exists(self, c, g):
     """Check whether a game key exists in the db."""
@@ -617,6 +621,13 @@ class PlayerRecentGames(BulkDBCache):
     c.executemany('''DELETE FROM player_recent_games WHERE name=%s
                             ORDER BY id LIMIT %s''', del_l)
     insert_games(c, games_l, 'player_recent_games')
+    self.expected_games = max(0, self.expected_games - len(self.gids))
+    if self.key_filter is not None:
+      for game_key in self.gids:
+        self.key_filter.add(game_key)
+      if self.key_filter.full():
+        # the games just inserted are visible to this connection.
+        self.init_key_filter(c, 2 * self.key_filter.capacity)
     self.clear()
 
   def clear(self):
@@ -639,7 +650,8 @@ class KillerStats(BulkDBCache):
       self.killer_stats[ckiller] = (1, g)
 
   def insert(self, c):
-    dirty_page('killers', len(self.killer_stats))
+    if self.killer_stats:
+      note_change('top_killers')
     killcounts_l = [(k,
                      self.killer_stats[k][0],
                      self.killer_stats[k][1]['name'])
@@ -858,6 +870,8 @@ class Streaks(BulkDBCache):
       for g in s.games:
         self._db_continue_streak(c, s.player, g, sid)
         #info("    inserting game %s" % g['game_key'])
+    if confirmed_streaks:
+      note_change('streaks')
 
     # finally, update player_last_games in the db
     last_games_del = [[name] for name in self.last_games.keys()]
@@ -908,10 +922,6 @@ class AllRecentGames(BulkDBCache):
       else:
         all_recent_game_count.flush_key() # why do we even bother with this case?
     insert_games(c, self.games,'all_recent_games')
-    dirty_page('recent', len(self.games))
-    # TODO: why are these here and not with the per-day stats?
-    dirty_page('per-day', len(self.games))
-    dirty_page('per-day-monthly', len(self.games))
     self.clear()
 
 class PlayerStats(BulkDBCache):
@@ -925,10 +935,17 @@ class PlayerStats(BulkDBCache):
     # table player_char_stats: dict key is lowercase name x charabbr, value
     # is a list of game count, max xl, win count
     self.pl_char = dict()
+    # changes to report for the leaderboards
+    self.changes = set()
 
   def update(self, g):
     lname = g['name'].lower()
     winc = game_is_win(g) and 1 or 0
+    self.changes.add('players')
+    if winc:
+      self.changes.add('players:wins')
+    if g['sc'] >= NOTABLE_SCORE:
+      self.changes.add('players:scores')
     if not self.pl_char.has_key((lname, g['charabbr'])):
       self.pl_char[(lname, g['charabbr'])] = [1, g['xl'], winc]
     else:
@@ -999,6 +1016,7 @@ class PlayerStats(BulkDBCache):
                           best_xl = GREATEST(best_xl, VALUES(best_xl)),
                           wins = wins + VALUES(wins)''',
                   pl_char_l)
+    note_change(*self.changes)
     self.clear()
 
 # handles two tables: per_day_stats and date_players
@@ -1031,13 +1049,6 @@ class PerDayStats(BulkDBCache):
       self.date_players[(edate, player)][0] += 1
       self.date_players[(edate, player)][1] += winc
 
-    # do the flush here because we are already working with the dates...
-    # don't query these values until insert() has been called.
-    # TODO: does it even make sense for these to be memoized?
-    count_players_per_day.flush_key(edate)
-    if winc:
-      winners_for_day.flush_key(edate)
-
   def insert(self, c):
     # TODO: is there a faster way to do this without ON DUPLICATE KEY UPDATE?
     per_day_l = [[k,
@@ -1064,6 +1075,10 @@ class PerDayStats(BulkDBCache):
                                          games = games + VALUES(games),
                                          wins = wins + VALUES(wins)''',
                 date_players_l)
+    # the cached per-day page stats for these days need reloading.
+    query.touch_days(self.per_day_stats.keys())
+    if self.per_day_stats:
+      note_change('per_day_stats')
     # commit needs to happen elsewhere
     self.clear()
 
@@ -1081,23 +1096,166 @@ def is_known_race(c, race):
 def is_known_class(c, cls):
   return is_known_cthing(c, 'known_classes', 'cls', cls)
 
-def record_known_thing(c, table, key, value):
-  query_do(c, "INSERT INTO " + table + " (" + key + ") " +
-           " VALUES (%s)", value)
-
-def update_known_races_classes(c, g):
-  race = g['raceabbr']
-  cls = g['clsabbr']
-  if not is_known_race(c, race):
-    record_known_thing(c, 'known_races', 'race', race)
-    is_known_race.set_key(True, race)
-    query.db_races.flush()
-    query.current_races.flush()
-  if not is_known_class(c, cls):
-    record_known_thing(c, 'known_classes', 'cls', cls)
-    is_known_class.set_key(True, cls)
-    query.db_classes.flush()
-    query.current_classes.flush()
+# TODO: does TOP_N really need to be 1000? does anyone ever even look at that
+# leaderboard?
+# The leaderboard is kept as a min-heap of the best n games, loaded from the
+# db on first use; games that make it in are only written out (and the ones
+# they push out deleted) when the cache is flushed. Heap entries are lists of
+# [sc, tiebreak, id, game]: id is the top_games row id, or None for a game not
+# yet written, and game is the game itself until it has been written.
+class TopGames(BulkDBCache):
+  def __init__(self, n):
+    self.n = n
+    self.heap = None
+    self.seq = 0
+    self.clear()
+
+  def clear(self):
+    self.evicted_ids = list()
+    self.top_changed = False
+
+  def init_from_db(self, c):
+    if self.heap is not None:
+      return
+    # among equal lowest scores the oldest game goes first, as with the old
+    # DELETE of the first row on the sc index: the tiebreak is the arrival
+    # order, which is the row id for games loaded from the db.
+    self.heap = [[sc, id, id, None] for id, sc in
+                 query_rows(c, '''SELECT id, sc FROM top_games''')]
+    heapq.heapify(self.heap)
+    # the scores of the games shown on the overview, lowest first.
+    self.top = sorted(heapq.nlargest(TOP_GAMES_SHOWN,
+                                     [e[0] for e in self.heap]))
+    self.seq = max([e[2] for e in self.heap] or [0])
+    self.max_id = self.seq
+
+  def update(self, c, g):
+    self.init_from_db(c)
+    if len(self.heap) >= self.n and g['sc'] <= self.heap[0][0]:
+      return
+    if game_is_buggy(g):
+      return
+    self.seq += 1
+    entry = [g['sc'], self.seq, None, g]
+    if len(self.heap) < self.n:
+      heapq.heappush(self.heap, entry)
+    else:
+      evicted = heapq.heapreplace(self.heap, entry)
+      if evicted[2] is not None:
+        self.evicted_ids.append(evicted[2])
+    if len(self.top) < TOP_GAMES_SHOWN or g['sc'] >= self.top[0]:
+      bisect.insort(self.top, g['sc'])
+      self.top = self.top[-TOP_GAMES_SHOWN:]
+      self.top_changed = True
+
+  def insert(self, c):
+    if self.heap is None:
+      return
+    c.executemany('''DELETE FROM top_games WHERE id = %s''',
+                  [[id] for id in self.evicted_ids])
+    pending = dict([(e[3]['game_key'], e) for e in self.heap
+                    if e[2] is None])
+    if pending:
+      # in arrival order, so that the new row ids keep the tiebreak order.
+      insert_games(c, [e[3] for e in sorted(pending.values(),
+                                            key=lambda e: e[1])],
+                   'top_games')
+      # pick up the ids of the new rows, so that they can be deleted later.
+      for id, game_key in query_rows(c, '''SELECT id, game_key FROM top_games
+                                                WHERE id > %s''',
+                                     self.max_id):
+        if game_key in pending:
+          pending[game_key][2] = id
+          pending[game_key][3] = None
+        self.max_id = max(self.max_id, id)
+    if self.top_changed:
+      note_change('top_games:top')
+    self.clear()
+
+# handles one of top_combo_scores, top_species_scores and top_class_scores,
+# which keep the best game for each value of `key`.
+class TopScores(BulkDBCache):
+  def __init__(self, table, key, best_score):
+    self.table = table
+    self.key = key
+    self.best_score = best_score # memoized best score for a key value
+    self.clear()
+
+  def clear(self):
+    self.games = dict() # key value -> game
+
+  def update(self, c, g):
+    value = g[self.key]
+    # the pending game is checked as well as the memoized score, in case the
+    # memoizer has dropped it and would re-read the older score from the db.
+    pending = self.games.get(value)
+    if pending is not None and g['sc'] <= pending['sc']:
+      return
+    if g['sc'] > self.best_score(c, value) and not game_is_buggy(g):
+      self.best_score.set_key(g['sc'], value)
+      self.games[value] = g
+
+  def insert(self, c):
+    if not self.games:
+      return
+    c.executemany("DELETE FROM " + self.table + " WHERE " + self.key + " = %s",
+                  [[v] for v in self.games.keys()])
+    insert_games(c, self.games.values(), self.table)
+    note_change(*["%s:%s" % (self.table, v) for v in self.games.keys()])
+    self.clear()
+
+class GhostVictims(BulkDBCache):
+  def __init__(self):
+    self.clear()
+
+  def clear(self):
+    self.victims = list() # (ghost, victim) pairs
+
+  def update(self, g):
+    if scload.is_ghost_kill(g):
+      ghost = scload.extract_ghost_name(g['killer'])
+      if ghost != g['name']:
+        self.victims.append((ghost, g['name']))
+
+  def insert(self, c):
+    if self.victims:
+      note_change('ghost_victims')
+    c.executemany('''INSERT INTO ghost_victims (ghost, victim)
+                          VALUES (%s, %s)''',
+                  self.victims)
+    self.clear()
+
+# handles two tables: known_races and known_classes
+class KnownRacesClasses(BulkDBCache):
+  def __init__(self):
+    self.clear()
+
+  def clear(self):
+    self.races = set()
+    self.classes = set()
+
+  def update(self, c, g):
+    race = g['raceabbr']
+    cls = g['clsabbr']
+    if not is_known_race(c, race):
+      is_known_race.set_key(True, race)
+      self.races.add(race)
+    if not is_known_class(c, cls):
+      is_known_class.set_key(True, cls)
+      self.classes.add(cls)
+
+  def insert(self, c):
+    if self.races:
+      c.executemany("INSERT IGNORE INTO known_races (race) VALUES (%s)",
+                    [[r] for r in self.races])
+      query.db_races.flush()
+      query.current_races.flush()
+    if self.classes:
+      c.executemany("INSERT IGNORE INTO known_classes (cls) VALUES (%s)",
+                    [[x] for x in self.classes])
+      query.db_classes.flush()
+      query.current_classes.flush()
+    self.clear()
 
 player_recent_cache = PlayerRecentGames()
 player_stats_cache = PlayerStats()
@@ -1107,6 +1265,14 @@ all_recent_games_cache = AllRecentGames()
 killer_stats_cache = KillerStats()
 streaks_cache = Streaks()
 wins_cache = Wins()
+player_first_cache = PlayerFirstGames()
+top_games_cache = TopGames(TOP_N)
+top_combo_cache = TopScores('top_combo_scores', 'charabbr', top_score_for_combo)
+top_species_cache = TopScores('top_species_scores', 'raceabbr',
+                              top_score_for_species)
+top_class_cache = TopScores('top_class_scores', 'cls', top_score_for_class)
+ghost_victims_cache = GhostVictims()
+known_raceclasses_cache = KnownRacesClasses()
 
 def act_on_logfile_line(c, this_game):
   """Actually assign things and write to the db based on a logfile line
@@ -1115,24 +1281,30 @@ def act_on_logfile_line(c, this_game):
   points (high scores, lowest dungeon level, fastest wins) should be
   calculated elsewhere."""
 
-  global killer_stats_cache, per_day_stats_cache
+  global killer_stats_cache, per_day_stats_cache, top_games_cache
+  global top_combo_cache, top_species_cache, top_class_cache
+  global ghost_victims_cache, known_raceclasses_cache
 
   if 'start_time' not in this_game:
     return
 
   # Update statistics for this player's game.
   if update_player_stats(c, this_game):
-    update_topN(c, this_game, TOP_N)
-    update_combo_scores(c, this_game)
+    top_games_cache.update(c, this_game)
+    top_combo_cache.update(c, this_game)
+    top_species_cache.update(c, this_game)
+    top_class_cache.update(c, this_game)
     killer_stats_cache.update(this_game)
-    update_gkills(c, this_game)
+    ghost_victims_cache.update(this_game)
     per_day_stats_cache.update(this_game)
-    update_known_races_classes(c, this_game)
+    known_raceclasses_cache.update(c, this_game)
 
 def periodic_flush(c):
   global streaks_cache, player_stats_cache, per_day_stats_cache
   global all_recent_games_cache, killer_stats_cache, player_recent_cache
-  global player_best_cache, wins_cache
+  global player_best_cache, wins_cache, top_games_cache
+  global top_combo_cache, top_species_cache, top_class_cache
+  global ghost_victims_cache, known_raceclasses_cache, player_first_cache
   streaks_cache.insert(c)
   player_recent_cache.insert(c)
   player_best_cache.insert(c)
@@ -1141,3 +1313,10 @@ def periodic_flush(c):
   all_recent_games_cache.insert(c)
   killer_stats_cache.insert(c)
   wins_cache.insert(c)
+  player_first_cache.insert(c)
+  top_games_cache.insert(c)
+  top_combo_cache.insert(c)
+  top_species_cache.insert(c)
+  top_class_cache.insert(c)
+  ghost_victims_cache.insert(c)
+  known_raceclasses_cache.insert(c)
@@ -3,6 +3,7 @@
    import scload, query, crawl_utils, html, combos
    c = attributes['cursor']
 
+   COMBO_TABLES = [ 'top_combo_scores' ]
 %>
 <!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN"
           "http://www.w3.org/TR/html4/strict.dtd">
@@ -19,13 +20,18 @@
 
       <div class="page_content">
         <h2>Species Highscorers</h2>
-        ${html.top_species_scorers(query.top_species_scorers(c))}
+        ${pagedefs.fragment('species-highscorers', [ 'top_species_scores' ],
+                lambda: html.top_species_scorers(query.top_species_scorers(c)))}
 
         <h2>Class Highscorers</h2>
-        ${html.top_class_scorers(query.top_class_scorers(c))}
+        ${pagedefs.fragment('class-highscorers', [ 'top_class_scores' ],
+                lambda: html.top_class_scorers(query.top_class_scorers(c)))}
 
         <h2>Combo Highscorers</h2>
-        ${html.top_combo_scorers(query.top_combo_scorers(c))}
+        ${pagedefs.fragment('all-combo-highscorers', COMBO_TABLES,
+                lambda: html.top_combo_scorers(
+                  pagedefs.fragment('top-combo-scorers', COMBO_TABLES,
+                                    lambda: query.top_combo_scorers(c))))}
       </div>
     </div>
 
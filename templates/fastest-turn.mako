@@ -2,9 +2,9 @@
    import scload, query, html
    c = attributes['cursor']
 
-   game_text = \
-      html.ext_games_table( query.get_fastest_turn_player_games(c),
-                            first = 'turn', count=True, win=True )
+   game_text = pagedefs.fragment('fastest-wins-turn', [ 'wins' ],
+      lambda: html.ext_games_table( query.get_fastest_turn_player_games(c),
+                                    first = 'turn', count=True, win=True ))
 %>
 
 ${game_text}
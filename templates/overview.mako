@@ -2,10 +2,7 @@
    import query, scload, html, config
    c = attributes['cursor']
 
-   top_scores = query.find_games(c, 'top_games', sort_max='sc', limit=5)
-
-   streaks = query.all_streaks(c)
-   active_streaks = query.all_streaks(c, active_streaks=True)
+   COMBO_TABLES = [ 'top_combo_scores' ]
 %>
 <!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN"
           "http://www.w3.org/TR/html4/strict.dtd">
@@ -25,11 +22,14 @@
           <div class="row">
             <div>
               <h3>Recent Wins</h3>
-              ${html.ext_games_table(query.recent_wins(c), win=True)}
+              ${pagedefs.fragment('recent-wins', [ 'wins' ],
+                lambda: html.ext_games_table(query.recent_wins(c), win=True))}
             </div>
             <div>
 	          <h3>Recent All-Rune Wins</h3>
-              ${html.ext_games_table(query.recent_allrune_wins(c), win=True)}
+              ${pagedefs.fragment('recent-allrune-wins', [ 'wins' ],
+                lambda: html.ext_games_table(query.recent_allrune_wins(c),
+                                             win=True))}
             </div>
           </div>
 
@@ -38,7 +38,10 @@
           <div class="row">
             <div>
               <h3>Top Scores</h3>
-              ${html.ext_games_table(top_scores, count=True)}
+              ${pagedefs.fragment('overview-top-scores', [ 'top_games' ],
+                lambda: html.ext_games_table(
+                  query.find_games(c, 'top_games', sort_max='sc', limit=5),
+                  count=True))}
             </div>
             <div>
               <h3>Fastest Wins (Turn Count)</h3>
@@ -55,12 +58,16 @@
           <div class="row">
             <div>
 	          <h3>Best Streaks</h3>
-              ${html.all_streaks_table(streaks[:10])}
+              ${pagedefs.fragment('best-streaks', [ 'streaks' ],
+                lambda: html.all_streaks_table(query.all_streaks(c)[:10]))}
             </div>
 
             <div>
               <h3>Active Streaks</h3>
-              ${html.all_streaks_table(active_streaks[:10], active=True)}
+              ${pagedefs.fragment('active-streaks', [ 'streaks' ],
+                lambda: html.all_streaks_table(
+                  query.all_streaks(c, active_streaks=True)[:10],
+                  active=True))}
             </div>
           </div>
 
@@ -69,7 +76,10 @@
           <div class="row">
             <div>
               <h3>Most High Scores</h3>
-              ${html.combo_highscorers(c)}
+              ${pagedefs.fragment('combo-highscorers', COMBO_TABLES,
+                lambda: html.combo_highscorers(c,
+                  hs=pagedefs.fragment('top-combo-scorers', COMBO_TABLES,
+                                       lambda: query.top_combo_scorers(c))))}
             </div>
           </div>
 
@@ -79,12 +89,14 @@
             % if config.USE_MILESTONES:
             <div>
               <h3>Ziggurat Raiders</h3>
-              ${html.best_ziggurats(c)}
+              ${pagedefs.fragment('best-ziggurats', [ 'ziggurats' ],
+                lambda: html.best_ziggurats(c))}
             </div>
 
             <div>
               <h3>Runes Fetched at Lowest XL</h3>
-              ${html.youngest_rune_finds(c)}
+              ${pagedefs.fragment('youngest-rune-finds', [ 'low_xl_rune_finds' ],
+                lambda: html.youngest_rune_finds(c))}
               <p class="fineprint">
                 Note: the abyssal rune is not eligible.
               </p>
@@ -93,7 +105,8 @@
 
             <div>
               <h3>Most Pacific Wins</h3>
-              ${html.most_pacific_wins(c)}
+              ${pagedefs.fragment('most-pacific-wins', [ 'wins' ],
+                lambda: html.most_pacific_wins(c))}
               <p class="fineprint">
                 Winning games with the fewest slain creatures.
               </p>
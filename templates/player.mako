@@ -4,17 +4,20 @@
    c = attributes['cursor']
    player = attributes['player']
 
-   ostats = html.overall_player_stats(c, player)
+   # prebuilt by pagedefs when rendering pages for many players at once
+   data = attributes.get('data') or query.player_page_context(c, player)
+
+   ostats = html.overall_player_stats(c, player, data['ostats'])
    
    whereis = html.whereis(False, player)
-   wins = query.player_wins(c, player)
-   streaks = query.player_streaks(c, player, 10)
-   recent_games = query.player_recent_games(c, player)
-
-   combo_highscores = query.player_combo_highscores(c, player)
-   species_highscores = query.player_species_highscores(c, player)
-   class_highscores = query.player_class_highscores(c, player)
-   stats = query.player_stats_matrix(c, player)
+   wins = data['wins']
+   streaks = data['streaks']
+   recent_games = data['recent_games']
+
+   combo_highscores = data['combo_highscores']
+   species_highscores = data['species_highscores']
+   class_highscores = data['class_highscores']
+   stats = data['stats']
  %>
 <!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN"
           "http://www.w3.org/TR/html4/strict.dtd">
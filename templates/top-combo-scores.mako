@@ -2,7 +2,6 @@
    import scload, query, crawl_utils, html
    c = attributes['cursor']
 
-   top_combo_scores = query.top_combo_scores(c)
 %>
 <!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN"
           "http://www.w3.org/TR/html4/strict.dtd">
@@ -27,7 +26,8 @@
             The best scoring games for each character combo.
           </div>
 
-          ${html.top_combo_scores(top_combo_scores)}
+          ${pagedefs.fragment('top-combo-scores', [ 'top_combo_scores' ],
+                lambda: html.top_combo_scores(query.top_combo_scores(c)))}
         </div>
       </div>
     </div>
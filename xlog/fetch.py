@@ -0,0 +1,407 @@
+import os
+import re
+import ssl
+import json
+import time
+import socket
+import httplib
+import urlparse
+import threading
+import Queue
+import email.utils
+
+from logging import debug, info, warn
+
+# Fetches remote logfiles over http(s), appending to the local copies: each
+# file is requested from the local copy's size onward with a Range header, so
+# only the new lines are transferred. Files are fetched by a bounded pool of
+# threads, one host at a time per thread, over a kept-alive connection to that
+# host (so no host sees more than one connection from us). When a source's
+# server can't be reached, times out or returns a server error, the source is
+# skipped for a backoff period that doubles with each consecutive failure, so
+# that a slow or dead server costs at most one timeout every so often instead
+# of one per file per cycle.
+#
+# Most logfiles (e.g. those for old versions) never change, so the Fetcher
+# also keeps some state per file in a json file: the ETag and Last-Modified
+# validators from the last fetch, which make the next request conditional (a
+# 304 costs no more than the headers), and whether the server honours Range
+# requests (if not, a HEAD request checks the size before the whole file is
+# downloaded again). A file that hasn't grown for `idle_polls` passes is then
+# polled every 2, 4, 8... passes, up to every `max_idle_wait` + 1, until it
+# grows again, when it goes back to being polled every pass.
+
+DEFAULT_WORKERS = 8
+DEFAULT_TIMEOUT = 60
+BACKOFF_MIN = 60
+BACKOFF_MAX = 3600
+DEFAULT_IDLE_POLLS = 5
+DEFAULT_MAX_IDLE_WAIT = 60
+MAX_REDIRECTS = 3
+REDIRECTS = (301, 302, 303, 307, 308)
+CHUNK_SIZE = 1 << 16
+
+R_CONTENT_RANGE = re.compile(r'^bytes (\d+)-')
+
+class FetchError (IOError):
+  """A problem with one file, e.g. a 404 for a logfile that hasn't been
+  started yet."""
+  pass
+
+class ServerError (FetchError):
+  """A problem with the server, which backs off the whole source."""
+  pass
+
+def unverified_ssl_context():
+  # like wget --no-check-certificate; several servers have had lapsed certs.
+  if hasattr(ssl, '_create_unverified_context'):
+    return ssl._create_unverified_context()
+  return None
+
+class SourceState (object):
+  """Backoff and byte counts for one source."""
+  def __init__(self):
+    self.failures = 0
+    self.retry_at = 0
+    self.bytes = 0
+
+  def backing_off(self, now):
+    return self.retry_at > now
+
+  def failed(self, now):
+    self.failures += 1
+    delay = min(BACKOFF_MIN * 2 ** (self.failures - 1), BACKOFF_MAX)
+    self.retry_at = now + delay
+    return delay
+
+  def succeeded(self):
+    self.failures = 0
+    self.retry_at = 0
+
+class Connections (object):
+  """A fetch thread's connections, one per (scheme, host)."""
+  def __init__(self):
+    self.conns = { }
+
+  def connection(self, scheme, netloc, timeout):
+    conn = self.conns.get((scheme, netloc))
+    if conn is None:
+      if scheme == 'https':
+        context = unverified_ssl_context()
+        if context:
+          conn = httplib.HTTPSConnection(netloc, timeout=timeout,
+                                         context=context)
+        else:
+          conn = httplib.HTTPSConnection(netloc, timeout=timeout)
+      elif scheme == 'http':
+        conn = httplib.HTTPConnection(netloc, timeout=timeout)
+      else:
+        raise FetchError("Can't fetch %s URLs" % scheme)
+      self.conns[(scheme, netloc)] = conn
+    conn.timeout = timeout
+    if conn.sock:
+      conn.sock.settimeout(timeout)
+    return conn
+
+  def request(self, method, url, headers, timeout):
+    scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+    if query:
+      path += '?' + query
+    conn = self.connection(scheme, netloc, timeout)
+    reused = conn.sock is not None
+    try:
+      conn.request(method, path or '/', headers=headers)
+      return conn.getresponse()
+    except (httplib.HTTPException, socket.error) as e:
+      conn.close()
+      # the server may have closed a kept-alive connection; try a new one.
+      if not reused or isinstance(e, socket.timeout):
+        raise
+    conn.request(method, path or '/', headers=headers)
+    return conn.getresponse()
+
+  def open(self, method, url, headers, timeout):
+    """Returns the response to a request, following redirects."""
+    for i in range(MAX_REDIRECTS + 1):
+      resp = self.request(method, url, headers, timeout)
+      location = resp.getheader('location')
+      if resp.status not in REDIRECTS or not location:
+        return resp
+      resp.read()
+      url = urlparse.urljoin(url, location)
+    raise FetchError("Too many redirects fetching %s" % url)
+
+  def close(self):
+    for conn in self.conns.values():
+      conn.close()
+    self.conns = { }
+
+def http_time(s):
+  t = s and email.utils.parsedate_tz(s)
+  if not t:
+    return None
+  return email.utils.mktime_tz(t)
+
+def record_validators(validators, resp, size):
+  """Remembers the validators in a response that brought the local copy up to
+  `size` bytes."""
+  validators.pop('etag', None)
+  validators.pop('last_modified', None)
+  validators['size'] = size
+  etag = resp.getheader('etag')
+  if etag:
+    validators['etag'] = etag
+  # Last-Modified only has a resolution of a second: if the file was
+  # modified in the second the response was sent, it may change again without
+  # changing Last-Modified.
+  modified = resp.getheader('last-modified')
+  modified_t = http_time(modified)
+  date_t = http_time(resp.getheader('date'))
+  if modified_t is not None and date_t is not None and modified_t < date_t:
+    validators['last_modified'] = modified
+
+def fetch_file(conns, xlog, timeout, validators=None):
+  """Appends the part of the remote file past the end of the local copy to
+  the local copy. Returns the number of bytes appended. `validators` is a dict
+  that the caller keeps for the file between calls; see the comment at the
+  top."""
+  path = xlog.local_path
+  have = os.path.exists(path) and os.path.getsize(path) or 0
+  url = xlog.source_path
+  if validators is None:
+    validators = { }
+  headers = { }
+  # validators describe the remote file when the local copy was a given size.
+  if have and validators.get('size') == have:
+    if 'etag' in validators:
+      headers['If-None-Match'] = validators['etag']
+    if 'last_modified' in validators:
+      headers['If-Modified-Since'] = validators['last_modified']
+
+  if have and validators.get('ranges') is False:
+    # the server would send the whole file again, so check its size first.
+    resp = conns.open('HEAD', url, headers, timeout)
+    resp.read()
+    if resp.status == 304:
+      return 0
+    length = resp.getheader('content-length')
+    if resp.status == 200 and length is not None and int(length) == have:
+      record_validators(validators, resp, have)
+      return 0
+
+  if have:
+    headers['Range'] = 'bytes=%d-' % have
+  resp = conns.open('GET', url, headers, timeout)
+  if resp.status == 304:
+    resp.read()
+    return 0
+  if resp.status == 416:
+    # nothing past the end of the local copy.
+    resp.read()
+    return 0
+  if resp.status == 206:
+    m = R_CONTENT_RANGE.match(resp.getheader('content-range') or '')
+    if not m or int(m.group(1)) != have:
+      resp.read()
+      raise FetchError("Bad Content-Range fetching %s: %s"
+                       % (url, resp.getheader('content-range')))
+    validators['ranges'] = True
+    skip = 0
+  elif resp.status == 200:
+    # the server ignored the Range header and sent the whole file.
+    if have:
+      validators['ranges'] = False
+    length = resp.getheader('content-length')
+    if have and length is not None and int(length) < have:
+      resp.read()
+      raise FetchError("%s is shorter than the local copy %s (%s < %d)"
+                       % (url, path, length, have))
+    skip = have
+  else:
+    resp.read()
+    if resp.status >= 500:
+      raise ServerError("HTTP %d %s fetching %s"
+                        % (resp.status, resp.reason, url))
+    raise FetchError("HTTP %d %s fetching %s" % (resp.status, resp.reason, url))
+
+  written = 0
+  out = open(path, 'ab')
+  try:
+    while True:
+      chunk = resp.read(CHUNK_SIZE)
+      if not chunk:
+        break
+      if skip:
+        if len(chunk) <= skip:
+          skip -= len(chunk)
+          continue
+        chunk = chunk[skip:]
+        skip = 0
+      out.write(chunk)
+      written += len(chunk)
+  finally:
+    out.close()
+  if skip:
+    raise FetchError("%s is shorter than the local copy %s" % (url, path))
+  record_validators(validators, resp, have + written)
+  return written
+
+class Fetcher (object):
+  """Fetches remote XlogDefs in parallel; see the comment at the top. Keeps
+  the backoff state between calls, so a daemon should use one Fetcher for its
+  lifetime. The per-file state is kept in `state_file`, if given, so that it
+  survives restarts."""
+  def __init__(self, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT,
+               state_file=None, idle_polls=DEFAULT_IDLE_POLLS,
+               max_idle_wait=DEFAULT_MAX_IDLE_WAIT):
+    self.workers = max(workers, 1)
+    self.timeout = timeout
+    self.state_file = state_file
+    self.idle_polls = idle_polls
+    self.max_idle_wait = max_idle_wait
+    self.sources = { }
+    self.files = self.load_state()
+    self.lock = threading.Lock()
+
+  def load_state(self):
+    if not self.state_file or not os.path.exists(self.state_file):
+      return { }
+    try:
+      f = open(self.state_file)
+      try:
+        return json.load(f)
+      finally:
+        f.close()
+    except ValueError as e:
+      warn("Ignoring unreadable fetch state %s: %s" % (self.state_file, e))
+      return { }
+
+  def save_state(self):
+    if not self.state_file:
+      return
+    directory = os.path.dirname(self.state_file)
+    if directory and not os.path.isdir(directory):
+      os.makedirs(directory)
+    tmp = "%s.%d.tmp" % (self.state_file, os.getpid())
+    f = open(tmp, 'w')
+    try:
+      json.dump(self.files, f, indent=0, sort_keys=True)
+    finally:
+      f.close()
+    os.rename(tmp, self.state_file)
+
+  def polled(self, state, n):
+    """Schedules the next poll of a file that has just yielded n bytes."""
+    if n:
+      state['idle'] = 0
+      return
+    state['idle'] = state.get('idle', 0) + 1
+    if state['idle'] >= self.idle_polls:
+      passes = 2 ** min(state['idle'] - self.idle_polls + 1, 16)
+      state['wait'] = min(passes - 1, self.max_idle_wait)
+
+  def source_state(self, name):
+    if name not in self.sources:
+      self.sources[name] = SourceState()
+    return self.sources[name]
+
+  def timeout_for(self, xlog):
+    return getattr(xlog, 'fetch_timeout', None) or self.timeout
+
+  def fetch(self, xlogs):
+    """Fetches the given XlogDefs, other than local and dormant ones and those
+    from sources that are backing off. Returns a dict of source name -> bytes
+    fetched."""
+    now = time.time()
+    by_host = { }
+    skipped = set()
+    idle = 0
+    for x in xlogs:
+      if x.local or x.dormant:
+        continue
+      if self.source_state(x.source).backing_off(now):
+        skipped.add(x.source)
+        continue
+      state = self.files.setdefault(x.local_path, { })
+      if state.get('wait'):
+        state['wait'] -= 1
+        idle += 1
+        continue
+      host = urlparse.urlsplit(x.source_path)[:2]
+      by_host.setdefault(host, [ ]).append(x)
+    for name in sorted(skipped):
+      state = self.sources[name]
+      info("Skipping fetch from %s for another %ds after %d failure(s)"
+           % (name, state.retry_at - now, state.failures))
+    if not by_host:
+      self.save_state()
+      return { }
+
+    work = Queue.Queue()
+    for host in sorted(by_host):
+      work.put(by_host[host])
+    fetched = { }
+    files = { }
+    start = time.time()
+    threads = [ threading.Thread(target=self._work,
+                                 args=(work, fetched, files))
+                for i in range(min(self.workers, len(by_host))) ]
+    for t in threads:
+      t.daemon = True
+      t.start()
+    for t in threads:
+      t.join()
+    elapsed = time.time() - start
+
+    for name in sorted(fetched):
+      state = self.sources[name]
+      info("Fetched %d bytes from %s (%d file(s), %d bytes in total)"
+           % (fetched[name], name, files[name], state.bytes))
+    info("Fetched %d bytes from %d host(s) in %.2fs; %d idle file(s) not "
+         "polled" % (sum(fetched.values()), len(by_host), elapsed, idle))
+    self.save_state()
+    return fetched
+
+  def _work(self, work, fetched, files):
+    conns = Connections()
+    try:
+      while True:
+        try:
+          xlogs = work.get_nowait()
+        except Queue.Empty:
+          return
+        for x in xlogs:
+          self._fetch_one(conns, x, fetched, files)
+    finally:
+      conns.close()
+
+  def _fetch_one(self, conns, x, fetched, files):
+    state = self.source_state(x.source)
+    # an earlier file from the same source may have failed in this pass.
+    if state.backing_off(time.time()):
+      return
+    x.prepare()
+    debug("Fetching %s to %s" % (x.source_path, x.local_path))
+    try:
+      n = fetch_file(conns, x, self.timeout_for(x), self.files[x.local_path])
+    except FetchError as e:
+      if not isinstance(e, ServerError):
+        warn("Could not fetch %s: %s" % (x.source_path, e))
+        return
+      with self.lock:
+        delay = state.failed(time.time())
+      warn("Could not fetch %s: %s; backing off %s for %ds"
+           % (x.source_path, e, x.source, delay))
+      return
+    except (IOError, httplib.HTTPException) as e:
+      with self.lock:
+        delay = state.failed(time.time())
+      warn("Could not fetch %s: %s; backing off %s for %ds"
+           % (x.source_path, e or e.__class__.__name__, x.source, delay))
+      return
+    self.polled(self.files[x.local_path], n)
+    with self.lock:
+      state.succeeded()
+      state.bytes += n
+      fetched[x.source] = fetched.get(x.source, 0) + n
+      files[x.source] = files.get(x.source, 0) + 1
@@ -0,0 +1,48 @@
+import re
+
+# One key=value field, followed by the separator (or the end of the line).
+# Keys run up to the first '='; values may contain '=', and colons in values
+# are escaped by doubling them. (The value pattern is unrolled, which is
+# noticeably faster than an alternation in the python 2 regex engine.)
+R_XLOG_FIELD = re.compile(r'([^:=]*)=([^:]*(?:::[^:]*)*)(?::|$)')
+
+def field_count(line):
+  """Return the number of fields in an xlog line, not counting escaped colons
+  as separators.
+
+  >>> field_count('v=0.4:name=test:place=D::2:sc=65')
+  4
+  >>> field_count('a=b:::c=d')
+  2
+  >>> field_count('')
+  1
+  """
+  return line.count(':') - 2 * line.count('::') + 1
+
+def parse_xlog(line):
+  """Parse an xlog line (without its trailing newline) into a dictionary.
+  Raises ValueError if any field is not of the form key=value.
+
+  >>> d = parse_xlog('v=0.4:name=test:place=D::2:tmsg=a=b')
+  >>> sorted(d.items())
+  [('name', 'test'), ('place', 'D:2'), ('tmsg', 'a=b'), ('v', '0.4')]
+  >>> parse_xlog('msg=foo:::x=1')
+  {'msg': 'foo:', 'x': '1'}
+  >>> parse_xlog('v=0.4:junk:name=test')
+  Traceback (most recent call last):
+    ...
+  ValueError: malformed xlog line: v=0.4:junk:name=test
+  """
+  fields = R_XLOG_FIELD.findall(line)
+  if len(fields) != field_count(line):
+    raise ValueError("malformed xlog line: " + line)
+  d = dict(fields)
+  if '::' in line:
+    for k, v in fields:
+      if '::' in v:
+        d[k] = v.replace('::', ':')
+  return d
+
+if __name__ == "__main__":
+  import doctest
+  doctest.testmod()
@@ -0,0 +1,50 @@
+import mmap
+
+# How many bytes of the mapped file to split into lines at a time.
+BATCH_SIZE = 1024 * 1024
+
+def mapped_lines(filename, start, end, batch_size=BATCH_SIZE):
+  """Memory-map a file and yield (line start, line end, line) for every
+  complete (newline-terminated) line in the byte range [start, end). `start`
+  must be the start of a line, and nothing past `end` is read, so a partial
+  line at the end of the range is left for a later read. Lines are yielded
+  without their newlines.
+
+  >>> import tempfile
+  >>> f = tempfile.NamedTemporaryFile()
+  >>> f.write("a=1:b=2\\n\\nc=3\\npartial")
+  >>> f.flush()
+  >>> for l in mapped_lines(f.name, 0, 20, batch_size=4):
+  ...   print l
+  (0, 8, 'a=1:b=2')
+  (8, 9, '')
+  (9, 13, 'c=3')
+  >>> list(mapped_lines(f.name, 9, 12))
+  []
+  """
+  if end <= start:
+    return
+  f = open(filename, 'rb')
+  try:
+    m = mmap.mmap(f.fileno(), end, access=mmap.ACCESS_READ)
+  finally:
+    f.close()
+  try:
+    pos = start
+    while pos < end:
+      last_nl = m.rfind('\n', pos, min(pos + batch_size, end))
+      if last_nl == -1:
+        # a line longer than the batch; find where it ends, if it does.
+        last_nl = m.find('\n', pos, end)
+        if last_nl == -1:
+          break
+      for line in m[pos:last_nl].split('\n'):
+        line_end = pos + len(line) + 1
+        yield (pos, line_end, line)
+        pos = line_end
+  finally:
+    m.close()
+
+if __name__ == "__main__":
+  import doctest
+  doctest.testmod()
@@ -0,0 +1,118 @@
+class Record(object):
+  """Base class for compact dict-like records with a fixed set of fields,
+  stored in slots rather than a per-record dict. Create subclasses with
+  record_class. Fields can be read and written by name or by alias; any
+  other key that is assigned goes into a small overflow dict."""
+  __slots__ = ('_extra',)
+  FIELDS = ()
+  FIELD_SET = frozenset()
+  ALIASES = { }
+  CONVERSIONS = { }
+
+  def __init__(self, d=None):
+    self._extra = None
+    if d:
+      for k, v in d.iteritems():
+        self[k] = v
+
+  @classmethod
+  def from_xdict(cls, d):
+    """Build a record from a raw xlog dictionary, converting (non-empty)
+    values with the class conversions. Keys that are neither fields nor
+    aliases are dropped."""
+    r = cls()
+    aliases = cls.ALIASES
+    fields = cls.FIELD_SET
+    conversions = cls.CONVERSIONS
+    for k, v in d.iteritems():
+      k = aliases.get(k, k)
+      if k in fields:
+        if v and k in conversions:
+          v = conversions[k](v)
+        setattr(r, k, v)
+    return r
+
+  def __getitem__(self, key):
+    key = self.ALIASES.get(key, key)
+    if key in self.FIELD_SET:
+      try:
+        return getattr(self, key)
+      except AttributeError:
+        pass
+    elif self._extra and key in self._extra:
+      return self._extra[key]
+    raise KeyError(key)
+
+  def get(self, key, default=None):
+    key = self.ALIASES.get(key, key)
+    if key in self.FIELD_SET:
+      return getattr(self, key, default)
+    if self._extra:
+      return self._extra.get(key, default)
+    return default
+
+  def __setitem__(self, key, value):
+    key = self.ALIASES.get(key, key)
+    if key in self.FIELD_SET:
+      setattr(self, key, value)
+    else:
+      if self._extra is None:
+        self._extra = { }
+      self._extra[key] = value
+
+  def __contains__(self, key):
+    key = self.ALIASES.get(key, key)
+    if key in self.FIELD_SET:
+      return hasattr(self, key)
+    return bool(self._extra) and key in self._extra
+
+  has_key = __contains__
+
+  def keys(self):
+    keys = [f for f in self.FIELDS if hasattr(self, f)]
+    if self._extra:
+      keys.extend(self._extra.keys())
+    return keys
+
+  def items(self):
+    return [(k, self[k]) for k in self.keys()]
+
+  def __reduce__(self):
+    return (self.__class__, (dict(self.items()),))
+
+  def __repr__(self):
+    return "%s(%r)" % (self.__class__.__name__, dict(self.items()))
+
+def record_class(name, fields, aliases=None, conversions=None, module=None):
+  """Create a Record subclass with a slot for each of the given fields.
+  `aliases` maps alternate names to field names, and `conversions` maps
+  field names (or aliases) to functions that from_xdict applies to values.
+
+  >>> Game = record_class('Game', ['name', 'sc', 'start_time'],
+  ...                     aliases={'start': 'start_time'},
+  ...                     conversions={'sc': int})
+  >>> g = Game.from_xdict({'name': 'test', 'sc': '65', 'start': '2008',
+  ...                      'tiles': '1'})
+  >>> g['sc'], g['start'], g['start_time'], g.get('tiles')
+  (65, '2008', '2008', None)
+  >>> g['streak_id'] = 3
+  >>> 'start' in g, 'streak_id' in g, 'tiles' in g
+  (True, True, False)
+  >>> sorted(g.items())
+  [('name', 'test'), ('sc', 65), ('start_time', '2008'), ('streak_id', 3)]
+  """
+  fields = tuple(fields)
+  aliases = dict(aliases or { })
+  converted = dict([(aliases.get(k, k), fn)
+                    for k, fn in (conversions or { }).items()])
+  return type(name, (Record,),
+              { '__slots__': fields,
+                '__module__': module or __name__,
+                'FIELDS': fields,
+                'FIELD_SET': frozenset(fields),
+                'ALIASES': aliases,
+                'CONVERSIONS': converted })
+
+if __name__ == "__main__":
+  import doctest
+  doctest.testmod()
@@ -1,5 +1,6 @@
 import os.path
 import xlog.version
+import xlog.fetch
 import errno
 
 XLOG_LOCAL_STAGE = 'data'
@@ -19,7 +20,8 @@ class XlogDef (object):
   path on the local filesystem, remote path, and whether the source is
   filesystem-local or remote."""
 
-  def __init__(self, remote_path, source_name, base_url, local_base, dormant, xlog_type):
+  def __init__(self, remote_path, source_name, base_url, local_base, dormant, xlog_type,
+               fetch_timeout=None):
     self.raw_path = remote_path
     self.source = source_name
     self.xlog_type = xlog_type
@@ -27,6 +29,7 @@ class XlogDef (object):
     self.source_path, self.local = self._resolve_path(remote_path, local_base,
                                                       base_url)
     self.dormant = dormant
+    self.fetch_timeout = fetch_timeout
     self.version = xlog.version.version(self.raw_path)
     self.local_path = self._local_path(self.source,
                                        self.xlog_type,
@@ -48,12 +51,17 @@ class XlogDef (object):
       os.symlink(self.source_path, self.local_path)
 
   def fetch(self):
+    """Fetch this file by itself; see xlog.fetch.Fetcher for fetching many.
+    Returns the number of bytes fetched."""
     if self.local or self.dormant:
-      return
-    command = "wget --no-check-certificate --timeout=60 -q -c %s -O %s" % (self.source_path, self.local_path)
-    res = os.system(command)
-    if res != 0:
-      raise IOError, "Failed to fetch %s with %s" % (self.source_path, command)
+      return 0
+    self.prepare()
+    conns = xlog.fetch.Connections()
+    try:
+      return xlog.fetch.fetch_file(conns, self, self.fetch_timeout
+                                   or xlog.fetch.DEFAULT_TIMEOUT)
+    finally:
+      conns.close()
 
   def _resolve_path(self, path, local_base, base_url):
     return xlog_resolve_source_path(path, local_base, base_url)